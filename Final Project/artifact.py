@@ -0,0 +1,172 @@
+'''
+This file saves a compiled machine as a binary artifact and maps it back read-only with mmap.
+The file has a header (magic, format version, byte order, the machine's digest and a checksum of the
+rest), a section table, and the sections: the interned state and symbol tables and everything else small
+as JSON, then the dense next state, write and delta arrays and the sweep tables, each aligned to 8 bytes.
+Loading checks the header and checksum and casts memoryviews straight over the mapping, so nothing is
+compiled or copied and processes using the same artifact share one copy of its pages.
+machine_for compiles a table only when its artifact is missing, damaged, from another format version or
+stale, i.e. written for a table whose digest (engine.fingerprint) differs from the one given, and then
+writes a fresh artifact for the next process.
+    python artifact.py [PATH] writes the artifact of the machine in language.py
+'''
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+from engine import Alphabet, CompiledMachine, compile_machine, fingerprint
+import engine
+
+
+VERSION = 1 ## Bump when the layout changes, older artifacts are then rebuilt
+MAGIC = b"TMACHINE"
+HEADER = struct.Struct("<8sHHI32sIQ") ## magic, version, byte order, sections, digest, checksum, size
+SECTION = struct.Struct("<8sQQ") ## name, offset, length
+ORDERS = {"little": 1, "big": 2}
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__", "machine.%s.tm" % sys.implementation.cache_tag)
+
+
+class ArtifactError(ValueError):
+    '''The file is not an artifact this version can load.'''
+
+
+class StaleArtifact(ArtifactError):
+    '''The artifact was written for a different transition table.'''
+
+
+def _align(data):
+    data.extend(bytes(-len(data) % 8))
+
+
+def save(machine, path=PATH):
+    '''Writes a compiled machine to path, atomically, so readers never see half a file.'''
+    meta = {"initial_state": machine.initial_state, "final_states": sorted(machine.final_states, key=str),
+            "blank": machine.alphabet.blank, "states": machine.states, "symbols": machine.alphabet.symbols[1:-1],
+            "stride": machine.stride, "itemsize": machine.next_state.itemsize}
+    source = [[state, symbol, following, write, move]
+              for (state, symbol), (following, write, move) in machine.transition_function.items()]
+    tables = machine.sweep_tables if machine.stride <= 256 else []
+    sections = [(b"meta", json.dumps(meta).encode("utf-8")),
+                (b"next", bytes(machine.next_state)), (b"write", bytes(machine.write)), (b"delta", bytes(machine.delta)),
+                (b"final", bytes(machine.final)), (b"runaway", bytes(machine.runaway)), (b"sweep", bytes(machine.sweep)),
+                (b"sweeps", b"".join(tables)),
+                (b"source", json.dumps(source).encode("utf-8"))] ## Only parsed if someone asks for the table
+    start = HEADER.size + SECTION.size * len(sections)
+    table = bytearray()
+    payload = bytearray(-start % 8)
+    for name, data in sections:
+        table.extend(SECTION.pack(name, start + len(payload), len(data)))
+        payload.extend(data)
+        _align(payload)
+    body = bytes(table + payload)
+    header = HEADER.pack(MAGIC, VERSION, ORDERS[sys.byteorder], len(sections), bytes.fromhex(machine.digest),
+                         zlib.crc32(body), HEADER.size + len(body))
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = "%s.%d" % (path, os.getpid())
+    with open(temporary, "wb") as artifact:
+        artifact.write(header)
+        artifact.write(body)
+    os.replace(temporary, path)
+
+
+class MappedMachine(CompiledMachine):
+    '''A CompiledMachine whose arrays are read-only views of a mapped artifact. It runs exactly like the
+    machine that was saved; only the source table is rebuilt, the first time it is asked for.'''
+    def __init__(self, path=PATH, digest=None):
+        with open(path, "rb") as artifact:
+            try:
+                self.mapping = mmap.mmap(artifact.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: ## Empty file
+                raise ArtifactError("%s is empty" % path)
+        view = memoryview(self.mapping)
+        if len(view) < HEADER.size:
+            raise ArtifactError("%s is too short for an artifact" % path)
+        magic, version, order, count, raw, checksum, size = HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ArtifactError("%s is not a machine artifact" % path)
+        if version != VERSION or order != ORDERS[sys.byteorder]:
+            raise ArtifactError("%s has format %d (%s endian), this is %d (%s endian)"
+                                % (path, version, "little" if order == 1 else "big", VERSION, sys.byteorder))
+        if size != len(view) or zlib.crc32(view[HEADER.size:]) != checksum:
+            raise ArtifactError("%s is damaged, its checksum doesn't match" % path)
+        self.path = path
+        self.digest = raw.hex()
+        if digest != None and digest != self.digest:
+            raise StaleArtifact("%s was written for machine %s, not %s" % (path, self.digest[:16], digest[:16]))
+
+        sections = {}
+        for index in range(count):
+            name, offset, length = SECTION.unpack_from(view, HEADER.size + SECTION.size * index)
+            sections[name.rstrip(b"\0")] = view[offset:offset + length]
+        meta = json.loads(bytes(sections[b"meta"]).decode("utf-8"))
+        if meta["itemsize"] != 4:
+            raise ArtifactError("%s has %d byte transitions, this build reads 4" % (path, meta["itemsize"]))
+        self.initial_state = meta["initial_state"]
+        self.final_states = set(meta["final_states"])
+        self.states = meta["states"]
+        self.state_codes = dict((state, code) for code, state in enumerate(self.states))
+        self.alphabet = Alphabet(meta["symbols"], meta["blank"])
+        self.stride = meta["stride"]
+        self.next_state = sections[b"next"].cast("i")
+        self.write = sections[b"write"].cast("i")
+        self.delta = sections[b"delta"].cast("i")
+        self.final = sections[b"final"]
+        self.runaway = sections[b"runaway"].cast("b")
+        self.sweep = sections[b"sweep"]
+        sweeps = sections[b"sweeps"]
+        self.sweep_tables = [sweeps[i:i + 256] for i in range(0, len(sweeps), 256)] or [None] * (len(self.states) * 2)
+        self._source = sections[b"source"]
+        self._table = None
+
+    @property
+    def transition_function(self):
+        if self._table == None:
+            source = json.loads(bytes(self._source).decode("utf-8"))
+            self._table = dict(((state, symbol), (following, write, move)) for state, symbol, following, write, move in source)
+        return self._table
+
+    def __reduce__(self):
+        '''Pickles as the path, the other process maps the same file (or uses its own copy of the machine).'''
+        return _restore_mapped, (self.path, self.digest)
+
+
+def _restore_mapped(path, digest):
+    if digest not in engine._machines:
+        engine._machines[digest] = MappedMachine(path, digest)
+    return engine._machines[digest]
+
+
+def load(path=PATH, digest=None):
+    '''Maps the artifact at path. Raises ArtifactError if it can't be used, StaleArtifact if digest is
+    given and the artifact was written for another table.'''
+    machine = MappedMachine(path, digest)
+    if machine.digest not in engine._machines:
+        engine._machines[machine.digest] = machine
+    return engine._machines[machine.digest]
+
+
+def machine_for(transition_function, initial_state, final_states, blank="[]", path=PATH):
+    '''The machine for a table, mapped from its artifact when that is up to date, otherwise compiled and
+    saved for next time. Either way compile_machine returns it for this table afterwards.'''
+    digest = fingerprint(transition_function, initial_state, final_states, blank)
+    if digest not in engine._machines and path != None:
+        try:
+            load(path, digest)
+        except (OSError, ArtifactError):
+            machine = compile_machine(transition_function, initial_state, final_states, blank)
+            try:
+                save(machine, path)
+            except OSError:
+                pass ## A read-only directory only costs the compile next time
+    return compile_machine(transition_function, initial_state, final_states, blank)
+
+
+if __name__ == "__main__": ## python artifact.py [PATH]
+    import language
+    path = sys.argv[1] if len(sys.argv) > 1 else PATH
+    save(compile_machine(language.transition_function, language.initial_state, language.final_states, language.Tape.blank), path)
+    print("%s: machine %s, %d bytes" % (path, load(path).digest[:16], os.path.getsize(path)))
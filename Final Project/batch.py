@@ -0,0 +1,51 @@
+'''
+This file grades many routes at once on a pool of worker processes.
+The compiled machine is sent to each worker once when the pool starts, and the routes are handed
+out in chunks. With paths=False only the verdict and the grade come back (see language.grade), so
+the per-step path never has to be pickled across processes.
+'''
+
+import multiprocessing
+import language
+
+
+_machine = None ## Compiled machine of this worker process
+_max_steps = language.MAX_STEPS
+
+
+def _start_worker(machine, max_steps):
+    global _machine, _max_steps
+    _machine = machine
+    _max_steps = max_steps
+
+
+def _accept(job):
+    index, route = job
+    return index, language.accept(route, _max_steps, machine=_machine)
+
+
+def _grade(job):
+    index, route = job
+    return index, language.grade(route, _max_steps, machine=_machine)
+
+
+def accept_many(inputs, workers=None, chunksize=64, ordered=True, paths=True, max_steps=language.MAX_STEPS):
+    '''Grades every route in inputs on a pool of workers processes (all cores by default).
+    Yields the accept result of each route in input order, or (index, result) pairs as they complete
+    if ordered is False. With paths=False the results are grade results, ("Accept", grade) or
+    ("Reject", reason), which are much cheaper to send back. workers=0 grades in this process.'''
+    task = _accept if paths else _grade
+    jobs = enumerate(inputs)
+    if workers == 0:
+        _start_worker(language.machine, max_steps)
+        for job in jobs:
+            index, result = task(job)
+            yield result if ordered else (index, result)
+        return
+    with multiprocessing.Pool(workers, _start_worker, (language.machine, max_steps)) as pool:
+        if ordered:
+            for index, result in pool.imap(task, jobs, chunksize):
+                yield result
+        else:
+            for pair in pool.imap_unordered(task, jobs, chunksize):
+                yield pair
@@ -0,0 +1,195 @@
+'''
+This file benchmarks the grading machine on generated routes from 5 to 10,000 tokens.
+Routes are drawn from the hold and move vocabularies read off transition_function with a fixed seed,
+so every run grades the same routes. Each engine grades the same routes in the same run and is timed
+(best of repeat), then run once more under tracemalloc for its peak memory. Results are written as JSON
+and can be saved as a baseline; later runs compared against it fail on slower times, more memory,
+bigger traces, or a different number of steps.
+    python bench.py [--sizes 5,50,500] [--engines interpreter,codegen] [--output results.json]
+                    [--save-baseline baseline.json | --baseline baseline.json [--tolerance 0.25]]
+'''
+
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import batch
+import codegen
+import language
+import lexer
+import lockstep
+
+
+SIZES = (5, 50, 500, 2000, 5000, 10000) ## Route lengths in tokens
+ENGINES = ("interpreter", "codegen", "grade", "lockstep", "batch")
+LOCKSTEP_STEPS = 10 ** 5 ## Lockstep can't skip sweeps, so routes taking more steps than this are left out
+MIN_SECONDS = 0.001 ## Timings below this are too noisy to call a regression
+
+
+def vocabulary(transition_function=language.transition_function):
+    '''(walls, holds, moves) of the route language (see lexer.vocabulary), keeping only the moves every
+    move-reading state handles, so a generated route is always accepted. That leaves out Rock over,
+    which stalls after a Crimp, Sloper, Under cling, Dyno or Bicycle.'''
+    walls, holds, moves = lexer.vocabulary(transition_function, language.initial_state)
+    rows = {}
+    for (state, symbol) in transition_function:
+        rows.setdefault(state, set()).add(symbol)
+    readers = [symbols for symbols in rows.values() if symbols.intersection(moves)]
+    return walls, holds, [move for move in moves if all(move in symbols for symbols in readers)]
+
+
+def generate(tokens, count=1, seed=0):
+    '''count routes of tokens tokens (rounded down to an even number, at least 2), the same ones for the
+    same arguments.'''
+    walls, holds, moves = vocabulary()
+    rng = random.Random("%d:%d" % (seed, tokens))
+    routes = []
+    for _ in range(count):
+        route = [rng.choice(walls), rng.choice(holds)]
+        while len(route) + 2 <= tokens:
+            route += [rng.choice(moves), rng.choice(holds)]
+        routes.append("_".join(route))
+    return routes
+
+
+def steps_of(route, max_steps=language.MAX_STEPS):
+    '''Number of steps the machine takes on route.'''
+    turing = language.Turing(route, "[]", language.initial_state, language.final_states, language.transition_function, language.machine)
+    return turing.run(max_steps)
+
+
+def _interpreter(routes, max_steps):
+    return [language.accept(route, max_steps) for route in routes]
+
+
+def _codegen(routes, max_steps):
+    return [language.accept(route, max_steps, backend="codegen") for route in routes]
+
+
+def _grade(routes, max_steps):
+    return [language.grade(route, max_steps) for route in routes]
+
+
+def _lockstep(routes, max_steps):
+    return lockstep.grade_many(routes, max_steps)
+
+
+def _batch(routes, max_steps):
+    return list(batch.accept_many(routes, paths=False, max_steps=max_steps))
+
+
+RUNNERS = {"interpreter": _interpreter, "codegen": _codegen, "grade": _grade, "lockstep": _lockstep, "batch": _batch}
+
+
+def measure(engine, routes, steps, max_steps=language.MAX_STEPS, repeat=3):
+    '''Times one engine on routes, which take steps steps in all. Returns the result dict, or None if
+    the engine can't run them.'''
+    if engine == "lockstep" and (lockstep.numpy == None or steps > LOCKSTEP_STEPS * len(routes)):
+        return None
+    runner = RUNNERS[engine]
+    seconds = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = runner(routes, max_steps)
+        elapsed = time.perf_counter() - start
+        seconds = elapsed if seconds == None else min(seconds, elapsed)
+    trace_bytes = sum(path.size() for verdict, path in results if verdict == "Accept" and not isinstance(path, str))
+    del results
+    tracemalloc.start()
+    results = runner(routes, max_steps) ## Only the parent process is seen for batch
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"engine": engine, "tokens": len(routes[0].split("_")), "routes": len(routes), "steps": steps,
+            "accepted": sum(1 for verdict, _ in results if verdict == "Accept"),
+            "seconds": seconds, "latency": seconds / len(routes),
+            "steps_per_sec": steps / seconds if seconds else 0.0,
+            "peak_bytes": peak, "trace_bytes": trace_bytes}
+
+
+def run(sizes=SIZES, engines=ENGINES, count=4, repeat=3, seed=0, max_steps=language.MAX_STEPS, log=None):
+    '''Benchmarks every engine on count routes of each size. Returns the report as a dict.'''
+    if "codegen" in engines:
+        codegen.load(language.machine) ## Generating and compiling is a one-off, not part of the timings
+    results = []
+    for tokens in sizes:
+        routes = generate(tokens, count, seed)
+        steps = sum(steps_of(route, max_steps) for route in routes)
+        for engine in engines:
+            result = measure(engine, routes, steps, max_steps, repeat)
+            if result == None:
+                continue
+            results.append(result)
+            if log != None:
+                log("%-11s %6d tokens %12d steps %10.4fs %14.0f steps/s %12d bytes peak %10d bytes trace"
+                    % (engine, result["tokens"], steps, result["seconds"], result["steps_per_sec"],
+                       result["peak_bytes"], result["trace_bytes"]))
+    return {"machine": language.machine.digest, "python": platform.python_version(),
+            "implementation": platform.python_implementation(), "platform": platform.platform(),
+            "seed": seed, "routes": count, "repeat": repeat, "max_steps": max_steps,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}
+
+
+def compare(report, baseline, tolerance=0.25):
+    '''Regressions of report against baseline, as a list of messages (empty if there are none).
+    Times, peak memory and trace size may grow by tolerance; step and accept counts must match.'''
+    regressions = []
+    if report["machine"] != baseline["machine"]:
+        regressions.append("machine changed: %s != %s" % (report["machine"][:16], baseline["machine"][:16]))
+    before = dict(((result["engine"], result["tokens"], result["routes"]), result) for result in baseline["results"])
+    for result in report["results"]:
+        old = before.get((result["engine"], result["tokens"], result["routes"]))
+        if old == None:
+            continue
+        name = "%s at %d tokens" % (result["engine"], result["tokens"])
+        for key in ("steps", "accepted"):
+            if result[key] != old[key]:
+                regressions.append("%s: %s %d != %d" % (name, key, result[key], old[key]))
+        if max(result["seconds"], old["seconds"]) >= MIN_SECONDS and result["seconds"] > old["seconds"] * (1 + tolerance):
+            regressions.append("%s: %.4fs, was %.4fs" % (name, result["seconds"], old["seconds"]))
+        for key in ("peak_bytes", "trace_bytes"):
+            if result[key] > old[key] * (1 + tolerance):
+                regressions.append("%s: %s %d, was %d" % (name, key, result[key], old[key]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the grading machine on generated routes.")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in SIZES), help="route lengths in tokens")
+    parser.add_argument("--engines", default=",".join(ENGINES), help="engines to measure")
+    parser.add_argument("--routes", type=int, default=4, help="routes of each size")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per measurement, the best counts")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-steps", type=int, default=language.MAX_STEPS)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", help="write the results to this JSON file as the new baseline")
+    parser.add_argument("--baseline", help="compare the results against this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed growth over the baseline")
+    args = parser.parse_args(argv)
+
+    engines = args.engines.split(",")
+    for engine in engines:
+        if engine not in RUNNERS:
+            parser.error("unknown engine %r" % engine)
+    report = run([int(size) for size in args.sizes.split(",")], engines, args.routes, args.repeat,
+                 args.seed, args.max_steps, print)
+    for path in (args.output, args.save_baseline):
+        if path != None:
+            with open(path, "w") as output:
+                json.dump(report, output, indent=2)
+    if args.baseline != None:
+        with open(args.baseline) as baseline:
+            regressions = compare(report, json.load(baseline), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            return 1
+        print("no regressions against %s" % args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+'''
+This file puts a bounded memoization layer in front of accept and grade.
+Routes are normalized first (whitespace around and inside each _-separated token is collapsed), and the
+normalized route is what gets graded, so equal routes share one entry. Entries are evicted least recently
+used first once there are more than maxsize of them. Only verdicts and grades are kept by default; the
+full path of an accepted route is cached only with keep_paths=True, since it is by far the largest part.
+With path set, grade results are also kept in a shelve file on disk that outlives the process.
+'''
+
+from collections import OrderedDict
+import shelve
+
+import language
+
+
+def normalize(route):
+    '''Canonical form of a route: tokens stripped and inner whitespace collapsed to single spaces.'''
+    return "_".join(" ".join(token.split()) for token in route.strip().split("_"))
+
+
+def _grade_of(path):
+    '''Grade of an accepted path: the symbol its last step wrote, the cell language.grade reads.'''
+    for state, head, old, new, sweep in path.records(path.count - 1):
+        return path.machine.alphabet.symbols[new]
+
+
+class GradeCache(object):
+    def __init__(self, maxsize=4096, path=None, keep_paths=False, max_steps=language.MAX_STEPS, machine=language.machine):
+        self.maxsize = maxsize
+        self.keep_paths = keep_paths
+        self.max_steps = max_steps
+        self.machine = machine
+        self.grades = OrderedDict() ## normalized route -> grade result
+        self.paths = OrderedDict() ## normalized route -> accept result, only with keep_paths
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.resimulated = 0 ## Accepted routes simulated again for a path that wasn't kept
+        self.disk = None
+        self.prefix = "%s:%d:" % (machine.digest[:16], max_steps) ## Disk keys depend on the machine and budget
+        if path != None:
+            self.disk = shelve.open(path)
+
+    def _remember(self, entries, key, value):
+        entries[key] = value
+        if len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+    def _cached(self, key): ## Result from memory or the disk tier, or None
+        if key in self.grades:
+            self.grades.move_to_end(key)
+            return self.grades[key], "memory"
+        if self.disk != None and self.prefix + key in self.disk:
+            result = self.disk[self.prefix + key]
+            self._remember(self.grades, key, result)
+            return result, "disk"
+        return None, None
+
+    def _store(self, key, result):
+        if self.disk != None:
+            self.disk[self.prefix + key] = result
+        self._remember(self.grades, key, result)
+
+    def grade(self, route):
+        '''Cached language.grade: ("Accept", grade) or ("Reject", reason) for the normalized route.'''
+        key = normalize(route)
+        result, tier = self._cached(key)
+        if tier == "memory":
+            self.hits += 1
+        elif tier == "disk":
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            result = language.grade(key, self.max_steps, self.machine)
+            self._store(key, result)
+        return result
+
+    def accept(self, route):
+        '''Cached language.accept. Rejects come from the grade cache. An accepted route is simulated for its
+        path, once per call unless keep_paths is set, and those runs count as resimulated, not as hits.'''
+        key = normalize(route)
+        if key in self.paths:
+            self.hits += 1
+            self.paths.move_to_end(key)
+            return self.paths[key]
+        known, tier = self._cached(key)
+        if known != None and known[0] == "Reject":
+            if tier == "memory":
+                self.hits += 1
+            else:
+                self.disk_hits += 1
+            return known
+        result = language.accept(key, self.max_steps, machine=self.machine)
+        if known != None:
+            self.resimulated += 1
+        else:
+            self.misses += 1
+            self._store(key, result if result[0] == "Reject" else ("Accept", _grade_of(result[1])))
+        if self.keep_paths and result[0] == "Accept":
+            self._remember(self.paths, key, result)
+        return result
+
+    def stats(self):
+        '''Hit and miss counts, as a dict.'''
+        lookups = self.hits + self.misses + self.disk_hits + self.resimulated
+        return {"hits": self.hits, "misses": self.misses, "disk_hits": self.disk_hits, "resimulated": self.resimulated,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "size": len(self.grades) + len(self.paths), "maxsize": self.maxsize}
+
+    def clear(self): ## Forget the in-memory entries and counts, the disk tier stays
+        self.grades.clear()
+        self.paths.clear()
+        self.hits = self.misses = self.disk_hits = self.resimulated = 0
+
+    def close(self):
+        if self.disk != None:
+            self.disk.close()
+            self.disk = None
@@ -0,0 +1,239 @@
+'''
+This file turns a compiled machine into specialized Python source, one block per state.
+Each block dispatches on the symbol under the head with if-chains over constant sets, jumps over its
+sweeps with the same C-level scan the interpreter uses, and keeps the state, head and tape buffer in locals. Blocks are reached
+through a balanced if-tree on the state number instead of a table lookup.
+The source is compiled once with compile() and the code object is cached on disk (marshal), keyed by
+the machine's digest, so later processes skip both generating and compiling it.
+A generated backend has the same run(tape, state, head, max_steps, trace) as CompiledMachine and
+produces the same results and traces; differential() checks that on any set of routes.
+'''
+
+import hashlib
+import marshal
+import os
+import sys
+
+from engine import RUNNING, HALTED, STUCK, LOOPING, MISSING, SPIN
+
+
+VERSION = 2 ## Bump when the generated code changes, so stale cache files are not loaded
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+
+def _emit_state(machine, state, lines, indent, traced):
+    '''Appends the block for one state to lines.'''
+    pad = " " * indent
+    stride = machine.stride
+    name = machine.states[state]
+    lines.append(pad + "## %s" % name)
+    if machine.final[state]:
+        lines.append(pad + "status = HALTED")
+        lines.append(pad + "break")
+        return
+
+    ## Group the symbols of this state by what they do
+    sweeps = {}
+    groups = {}
+    spins = []
+    for symbol in range(stride):
+        i = state * stride + symbol
+        nxt = machine.next_state[i]
+        if nxt == MISSING:
+            continue
+        if nxt == SPIN:
+            spins.append(symbol)
+        elif machine.sweep[i]:
+            sweeps.setdefault(machine.delta[i], []).append(symbol)
+        else:
+            same = machine.write[i] == symbol
+            key = (nxt, None if same else machine.write[i], machine.delta[i])
+            groups.setdefault(key, []).append(symbol)
+
+    ## Sweeps inside the written region jump straight to their end, like CompiledMachine.run
+    for move, symbols in sorted(sweeps.items()):
+        lines.append(pad + "if lo <= p < hi and c in %s:" % _set(symbols))
+        lines.append(pad + "    count = min(%ssweep_end(cells, p, lo, hi, %d, %d) - p%s, max_steps - steps)"
+                     % ("" if move > 0 else "-(", state, move, "" if move > 0 else ")"))
+        if traced:
+            lines.append(pad + "    record(%d, head, c, c, %scount)" % (state, "" if move > 0 else "-"))
+        lines.append(pad + "    head += %scount" % ("" if move > 0 else "-"))
+        lines.append(pad + "    steps += count")
+        lines.append(pad + "    continue")
+    if machine.runaway[state]:
+        outward = "p < lo" if machine.runaway[state] < 0 else "p >= hi"
+        lines.append(pad + "if c == 0 and %s:" % outward)
+        lines.append(pad + "    status = LOOPING")
+        lines.append(pad + "    break")
+
+    for move, symbols in sorted(sweeps.items()):
+        ## A sweep symbol outside the written region (only ever blank) is a plain step
+        groups.setdefault((state, None, move), []).extend(symbols)
+    for symbols in [spins] if spins else []:
+        lines.append(pad + "if c in %s:" % _set(symbols))
+        lines.append(pad + "    status = LOOPING")
+        lines.append(pad + "    break")
+    for (nxt, write, move), symbols in sorted(groups.items(), key=lambda item: -len(item[1])):
+        lines.append(pad + "if c in %s:" % _set(symbols))
+        written = "c" if write == None else str(write)
+        if traced:
+            lines.append(pad + "    record(%d, head, c, %s, 0)" % (state, written))
+        if write != None:
+            lines.append(pad + "    if lo <= p < hi:")
+            lines.append(pad + "        if c != %d:" % write)
+            lines.append(pad + "            cells[p] = %d" % write)
+            lines.append(pad + "            dirty = True")
+            lines.append(pad + "    else:")
+        else:
+            lines.append(pad + "    if not lo <= p < hi:")
+        lines.append(pad + "        tape.write_code(head, %s)" % written)
+        lines.append(pad + "        cells = tape.cells")
+        lines.append(pad + "        offset = tape.offset")
+        lines.append(pad + "        lo = tape.lo")
+        lines.append(pad + "        hi = tape.hi")
+        if move:
+            lines.append(pad + "    head += %d" % move)
+        if nxt != state:
+            lines.append(pad + "    state = %d ## %s" % (nxt, machine.states[nxt]))
+        lines.append(pad + "    steps += 1")
+        lines.append(pad + "    continue")
+    lines.append(pad + "status = STUCK")
+    lines.append(pad + "break")
+
+
+def _set(symbols):
+    return "{%s}" % ", ".join(str(symbol) for symbol in sorted(symbols)) if len(symbols) > 1 else "(%d,)" % symbols[0]
+
+
+def _emit_tree(machine, states, lines, indent, traced):
+    '''Balanced if-tree over the state numbers, with the state blocks at the leaves.'''
+    pad = " " * indent
+    if len(states) == 1:
+        _emit_state(machine, states[0], lines, indent, traced)
+        return
+    middle = len(states) // 2
+    lines.append(pad + "if state < %d:" % states[middle])
+    _emit_tree(machine, states[:middle], lines, indent + 4, traced)
+    lines.append(pad + "else:")
+    _emit_tree(machine, states[middle:], lines, indent + 4, traced)
+
+
+def generate(machine):
+    '''Python source of a module with run(tape, state, head, max_steps) and
+    run_traced(tape, state, head, max_steps, record) for this machine.'''
+    lines = ["## Generated by codegen.py from machine %s, do not edit" % machine.digest, ""]
+    for traced in (False, True):
+        if traced:
+            lines.append("def run_traced(tape, state, head, max_steps, record):")
+        else:
+            lines.append("def run(tape, state, head, max_steps):")
+        lines.append("    cells = tape.cells")
+        lines.append("    offset = tape.offset")
+        lines.append("    lo = tape.lo")
+        lines.append("    hi = tape.hi")
+        lines.append("    dirty = False")
+        lines.append("    steps = 0")
+        lines.append("    status = RUNNING")
+        lines.append("    while True:")
+        lines.append("        p = head + offset")
+        lines.append("        c = cells[p] if lo <= p < hi else 0")
+        lines.append("        if steps >= max_steps:")
+        lines.append("            if machine_final[state]:")
+        lines.append("                status = HALTED")
+        lines.append("            break")
+        _emit_tree(machine, list(range(len(machine.states))), lines, 8, traced)
+        lines.append("    if dirty:")
+        lines.append("        tape.dirty = True")
+        lines.append("    return state, head, steps, status")
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+class GeneratedMachine(object):
+    '''Runs a CompiledMachine through its generated code. Everything but run is the compiled machine's.'''
+    def __init__(self, machine, namespace):
+        self.machine = machine
+        self._run = namespace["run"]
+        self._run_traced = namespace["run_traced"]
+
+    def __getattr__(self, name):
+        return getattr(self.machine, name)
+
+    def run(self, tape, state, head, max_steps, trace=None):
+        if trace != None:
+            return self._run_traced(tape, state, head, max_steps, trace.record)
+        return self._run(tape, state, head, max_steps)
+
+
+_loaded = {}
+def load(machine, cache_dir=CACHE_DIR):
+    '''Generated backend for a machine, from memory, the disk cache, or freshly generated and compiled.'''
+    if machine.digest in _loaded:
+        return _loaded[machine.digest]
+    key = hashlib.sha256(("%s:%d" % (machine.digest, VERSION)).encode("utf-8")).hexdigest()[:24]
+    path = None
+    code = None
+    if cache_dir != None:
+        path = os.path.join(cache_dir, "tm_%s.%s.bin" % (key, sys.implementation.cache_tag))
+        try:
+            with open(path, "rb") as cache:
+                code = marshal.load(cache)
+        except (OSError, EOFError, ValueError, TypeError):
+            code = None
+    if code == None:
+        code = compile(generate(machine), "<machine %s>" % machine.digest[:12], "exec")
+        if path != None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                temporary = "%s.%d" % (path, os.getpid())
+                with open(temporary, "wb") as cache:
+                    marshal.dump(code, cache)
+                os.replace(temporary, path)
+            except OSError:
+                pass ## A read-only cache directory only costs the compile next time
+    namespace = {"RUNNING": RUNNING, "HALTED": HALTED, "STUCK": STUCK, "LOOPING": LOOPING,
+                 "machine_final": machine.final, "sweep_end": machine.sweep_end}
+    exec(code, namespace)
+    _loaded[machine.digest] = GeneratedMachine(machine, namespace)
+    return _loaded[machine.digest]
+
+
+def differential(routes, max_steps=None, machine=None):
+    '''Runs every route through the interpreter and the generated code and compares the results and
+    the full traces. Returns a list of (route, description) for every route where they differ.'''
+    import language
+    if max_steps == None:
+        max_steps = language.MAX_STEPS
+    if machine == None:
+        machine = language.machine
+    generated = load(machine)
+    mismatches = []
+    for route in routes:
+        runs = []
+        for backend in (machine, generated):
+            turing = language.Turing(route, "[]", machine.initial_state, machine.final_states, machine.transition_function, machine)
+            turing.backend = backend ## Set directly, so the differential run can't share a cached choice
+            trace = turing.start_trace()
+            turing.run(max_steps)
+            runs.append(((turing.current_state, turing.get_tape(), turing.head_position, turing.status), trace))
+        (interpreted, interpreted_trace), (compiled, compiled_trace) = runs
+        if interpreted != compiled:
+            mismatches.append((route, "final configuration %r != %r" % (interpreted, compiled)))
+            continue
+        for step, (left, right) in enumerate(zip(interpreted_trace, compiled_trace)):
+            if left != right:
+                mismatches.append((route, "step %d: %r != %r" % (step, left, right)))
+                break
+        else:
+            if len(interpreted_trace) != len(compiled_trace):
+                mismatches.append((route, "trace length %d != %d" % (len(interpreted_trace), len(compiled_trace))))
+    return mismatches
+
+
+if __name__ == "__main__": ## python codegen.py [route ...] checks the routes, or prints the generated source
+    if len(sys.argv) > 1:
+        for route, description in differential(sys.argv[1:]):
+            print("%s: %s" % (route, description))
+    else:
+        import language
+        print(generate(language.machine))
@@ -0,0 +1,415 @@
+'''
+This file compiles a transition function into an integer-coded table for the Turing Machine.
+Every state and tape symbol is interned to a small integer, and the transitions are laid out
+in three flat arrays (next state, symbol to write, head delta) indexed by state * stride + symbol.
+A step is then one index computation and three array reads instead of building and hashing a
+(state, symbol) tuple of strings and comparing "R"/"L" strings.
+The Turing class in language.py stays the front end; this is only the representation it runs on.
+'''
+
+from array import array
+from itertools import repeat
+import hashlib
+
+
+MOVES = {"R": 1, "L": -1} ## Any other direction leaves the head where it is, same as Turing.step did
+
+## Why a run stopped
+RUNNING = "running" ## Step budget ran out, the machine can keep going
+HALTED = "halted"   ## Reached a final state
+STUCK = "stuck"     ## No transition for the current state and symbol
+LOOPING = "looping" ## Provably never halts
+
+## Markers in next_state
+MISSING = -1 ## No transition
+SPIN = -2    ## Transition back to the same state, writing the same symbol, without moving
+
+
+class Alphabet(object):
+    '''Interned tape symbols. The blank is always code 0, and the last code (foreign) stands in
+    for any symbol the transition function never mentions, so those cells have no transitions.'''
+    def __init__(self, symbols=(), blank="[]"):
+        self.blank = blank
+        self.symbols = [blank]
+        self.codes = {blank: 0}
+        for symbol in symbols:
+            if symbol not in self.codes:
+                self.codes[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        self.foreign = len(self.symbols)
+        self.symbols.append(None) ## Placeholder, foreign cells keep their own text on the tape
+        self.rendered = [symbol + " " if symbol != None else None for symbol in self.symbols]
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def code(self, symbol): ## Code for a symbol, or the foreign code if it is not in the alphabet
+        return self.codes.get(symbol, self.foreign)
+
+    def buffer(self, size): ## Blank buffer able to hold every code of this alphabet
+        if len(self.symbols) <= 256:
+            return bytearray(size)
+        return array('H', repeat(0, size))
+
+
+class Tape(object):
+    '''Tape of interned symbol codes in one contiguous buffer (bytearray when the alphabet fits in a byte).
+    Cell i of the tape lives at cells[i + offset]. Only the written region cells[lo:hi] is part of the tape,
+    the rest of the buffer is spare room so the tape can grow in both directions without copying every time.
+    The rendered string is cached and only rebuilt after a write changed a symbol (dirty).'''
+    blank = "[]" ## Blank character
+    def __init__(self, string="", alphabet=None): ## Break string into a list of the characters in alphabet
+        if alphabet == None:
+            alphabet = Alphabet((), Tape.blank)
+        self.alphabet = alphabet
+        self.foreign = {} ## Text of cells holding symbols outside the alphabet
+        chars = string.split('_')
+        self.cells = alphabet.buffer(len(chars))
+        self.offset = 0
+        self.lo = 0
+        self.hi = len(chars)
+        for index, char in enumerate(chars):
+            self.cells[index] = alphabet.code(char)
+            if self.cells[index] == alphabet.foreign:
+                self.foreign[index] = char
+        self.rendered = None
+        self.dirty = False ## A cell changed since the last render
+
+    def __str__(self): ## Return the string of the tape
+        if self.rendered == None or self.dirty:
+            rendered = self.alphabet.rendered
+            if self.foreign:
+                parts = []
+                for i in range(self.lo, self.hi):
+                    index = i - self.offset
+                    parts.append(self.foreign[index] + " " if index in self.foreign else rendered[self.cells[i]])
+                self.rendered = "".join(parts)
+            else:
+                self.rendered = "".join(map(rendered.__getitem__, self.cells[self.lo:self.hi]))
+            self.dirty = False
+        return self.rendered
+
+    def __getitem__(self, index): ## Get the character at the index
+        i = index + self.offset
+        if self.lo <= i < self.hi:
+            if index in self.foreign:
+                return self.foreign[index]
+            return self.alphabet.symbols[self.cells[i]]
+        return Tape.blank
+
+    def __setitem__(self, index, value): ## Set the character at the index
+        self.foreign.pop(index, None)
+        code = self.alphabet.code(value)
+        if code == self.alphabet.foreign:
+            self.foreign[index] = value
+            self.dirty = True
+        self.write_code(index, code)
+
+    def __len__(self): ## Number of cells in the written region
+        return self.hi - self.lo
+
+    def code_at(self, index): ## Get the interned code at the index
+        i = index + self.offset
+        if self.lo <= i < self.hi:
+            return self.cells[i]
+        return 0
+
+    def write_code(self, index, code): ## Write an interned code, growing the written region if needed
+        i = index + self.offset
+        if not self.lo <= i < self.hi:
+            i = self.extend(index)
+        elif self.cells[i] == code:
+            return
+        self.cells[i] = code
+        self.dirty = True
+
+    def snapshot(self):
+        '''Copy of the written region as (index of its first cell, codes). Foreign text is not included.'''
+        return self.lo - self.offset, self.cells[self.lo:self.hi]
+
+    @classmethod
+    def restore(cls, alphabet, snapshot, foreign=None): ## Build a tape from a snapshot
+        tape = cls.__new__(cls)
+        tape.alphabet = alphabet
+        tape.foreign = dict(foreign or {})
+        start, cells = snapshot
+        tape.cells = cells[:]
+        tape.offset = -start
+        tape.lo = 0
+        tape.hi = len(cells)
+        tape.rendered = None
+        tape.dirty = False
+        return tape
+
+    def extend(self, index):
+        '''Adds the cell at index, and any blank cells between it and the written region, to the written
+        region and returns its buffer position. The buffer at least doubles when it runs out of room on either side.'''
+        i = index + self.offset
+        if i < 0:
+            grow = max(len(self.cells), 16, -i)
+            self.cells[0:0] = self.alphabet.buffer(grow)
+            self.offset += grow
+            self.lo += grow
+            self.hi += grow
+            i += grow
+        elif i >= len(self.cells):
+            self.cells.extend(self.alphabet.buffer(max(len(self.cells), 16, i + 1 - len(self.cells))))
+        self.lo = min(self.lo, i)
+        self.hi = max(self.hi, i + 1)
+        self.dirty = True
+        return i
+
+
+def fingerprint(transition_function, initial_state, final_states, blank="[]"):
+    '''Checksum of a machine definition, the same for equal tables no matter how they were built.'''
+    source = repr((sorted(transition_function.items()), initial_state, sorted(final_states, key=str), blank))
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+class CompiledMachine(object):
+    def __init__(self, transition_function, initial_state, final_states, blank="[]"):
+        self.transition_function = transition_function
+        self.initial_state = initial_state
+        self.final_states = set(final_states)
+        self.digest = fingerprint(transition_function, initial_state, final_states, blank)
+
+        ## Intern states in order of first appearance, so the initial state is always 0
+        self.states = []
+        self.state_codes = {}
+        self._intern_state(initial_state)
+        symbols = []
+        for (state, symbol), (next_state, write, _) in transition_function.items():
+            self._intern_state(state)
+            self._intern_state(next_state)
+            symbols.append(symbol)
+            symbols.append(write)
+        for state in sorted(self.final_states, key=str):
+            self._intern_state(state)
+        self.alphabet = Alphabet(symbols, blank)
+
+        ## Dense table, next_state holds MISSING or SPIN where the machine can't make progress
+        self.stride = len(self.alphabet)
+        size = len(self.states) * self.stride
+        self.next_state = array('i', [MISSING]) * size
+        self.write = array('i', [0]) * size
+        self.delta = array('i', [0]) * size
+        for (state, symbol), (next_state, write, move) in transition_function.items():
+            i = self.state_codes[state] * self.stride + self.alphabet.codes[symbol]
+            self.next_state[i] = self.state_codes[next_state]
+            self.write[i] = self.alphabet.codes[write]
+            self.delta[i] = MOVES.get(move, 0)
+        self.final = bytearray(len(self.states))
+        for state in self.final_states:
+            self.final[self.state_codes[state]] = 1
+
+        ## Load-time non-termination analysis. A transition that stays in its state on the same symbol
+        ## without moving spins forever. A state that stays in itself on blank while moving is a runaway:
+        ## once it is outside the written region heading outwards, it only ever sees blanks again.
+        self.runaway = array('b', [0]) * len(self.states)
+        for state in range(len(self.states)):
+            if self.final[state]:
+                continue
+            for symbol in range(self.stride):
+                i = state * self.stride + symbol
+                if self.next_state[i] == state and self.delta[i] == 0 and self.write[i] == symbol:
+                    self.next_state[i] = SPIN
+            if self.next_state[state * self.stride] == state:
+                self.runaway[state] = self.delta[state * self.stride]
+
+        ## Sweeps: transitions that stay in their state, rewrite the same symbol and move. A run of them
+        ## is jumped over in one go, using a translate table per state and direction that maps the
+        ## symbols the state sweeps over to 0 and everything else to 1. Only for byte-sized tapes.
+        self.sweep = bytearray(size)
+        self.sweep_tables = [None] * (len(self.states) * 2)
+        if self.stride <= 256:
+            for state in range(len(self.states)):
+                for move in (-1, 1):
+                    table = bytearray([1]) * 256
+                    for symbol in range(self.stride):
+                        i = state * self.stride + symbol
+                        if self.next_state[i] == state and self.write[i] == symbol and self.delta[i] == move:
+                            self.sweep[i] = 1
+                            table[symbol] = 0
+                    self.sweep_tables[state * 2 + (move > 0)] = bytes(table)
+
+    def __reduce__(self):
+        '''Pickles the compiled arrays, and unpickles to the machine already loaded under the same
+        digest if there is one, so shipping a machine to another process never compiles it again.'''
+        return _restore_machine, (self.digest, self.__dict__)
+
+    def _intern_state(self, state):
+        if state not in self.state_codes:
+            self.state_codes[state] = len(self.states)
+            self.states.append(state)
+
+    def lookup(self, state, symbol):
+        '''Returns (next_state, write, delta) codes for a state and symbol code, or None if there is no transition.'''
+        i = state * self.stride + symbol
+        if self.next_state[i] == MISSING:
+            return None
+        if self.next_state[i] == SPIN:
+            return state, self.write[i], self.delta[i]
+        return self.next_state[i], self.write[i], self.delta[i]
+
+    def run(self, tape, state, head, max_steps, trace=None):
+        '''Tight stepping loop. Runs from (state, head) on the tape until a final state is reached,
+        no transition exists, the machine provably never halts, or max_steps steps were taken.
+        Returns (state, head, steps, status) where status is one of the statuses above.
+        Works directly on the Tape buffer (cells, offset and the written region lo:hi).
+        Sweeps are taken as one macro-step but still count every step they skip.
+        If a trace is given every step (or sweep) is recorded in it.'''
+        next_state = self.next_state
+        write = self.write
+        delta = self.delta
+        final = self.final
+        runaway = self.runaway
+        sweep = self.sweep
+        stride = self.stride
+        record = None
+        if trace != None:
+            record = trace.record
+        cells = tape.cells
+        offset = tape.offset
+        lo = tape.lo
+        hi = tape.hi
+        dirty = False
+        status = RUNNING
+        steps = 0
+        while steps < max_steps:
+            if final[state]:
+                status = HALTED
+                break
+            p = head + offset
+            if lo <= p < hi:
+                old = cells[p]
+                i = state * stride + old
+                nxt = next_state[i]
+                if nxt < 0:
+                    status = STUCK if nxt == MISSING else LOOPING
+                    break
+                if sweep[i]:
+                    move = delta[i]
+                    count = min(abs(self.sweep_end(cells, p, lo, hi, state, move) - p), max_steps - steps)
+                    if record != None:
+                        record(state, head, old, old, count * move)
+                    head += count * move
+                    steps += count
+                    continue
+                if record != None:
+                    record(state, head, old, write[i])
+                if old != write[i]:
+                    cells[p] = write[i]
+                    dirty = True
+            else:
+                i = state * stride
+                nxt = next_state[i]
+                if nxt < 0:
+                    status = STUCK if nxt == MISSING else LOOPING
+                    break
+                if runaway[state] and (runaway[state] < 0) == (p < lo):
+                    status = LOOPING
+                    break
+                if record != None:
+                    record(state, head, 0, write[i])
+                tape.write_code(head, write[i]) ## Grows the buffer, so reload it
+                cells = tape.cells
+                offset = tape.offset
+                lo = tape.lo
+                hi = tape.hi
+            head += delta[i]
+            state = nxt
+            steps += 1
+        else:
+            if final[state]:
+                status = HALTED
+        if dirty:
+            tape.dirty = True
+        return state, head, steps, status
+
+    def step(self, tape, state, head, trace=None):
+        '''Takes a single transition, without sweeps. Returns (state, head, status) like run.'''
+        if self.final[state]:
+            return state, head, HALTED
+        old = tape.code_at(head)
+        i = state * self.stride + old
+        nxt = self.next_state[i]
+        if nxt < 0:
+            return state, head, STUCK if nxt == MISSING else LOOPING
+        p = head + tape.offset
+        if self.runaway[state] and not tape.lo <= p < tape.hi and (self.runaway[state] < 0) == (p < tape.lo):
+            return state, head, LOOPING
+        if trace != None:
+            trace.record(state, head, old, self.write[i])
+        tape.write_code(head, self.write[i])
+        if self.final[nxt]:
+            return nxt, head + self.delta[i], HALTED
+        return nxt, head + self.delta[i], RUNNING
+
+    def sweep_end(self, cells, p, lo, hi, state, move):
+        '''Buffer position of the first cell from p in the direction of move that leaves the sweep of this state,
+        or the first position outside the written region lo:hi. Scans chunks of doubling size with
+        bytes.translate, so a sweep of k cells costs O(k) work in C rather than k trips through the loop.'''
+        table = self.sweep_tables[state * 2 + (move > 0)]
+        size = 64
+        if move > 0:
+            while p < hi:
+                found = cells[p:min(p + size, hi)].translate(table).find(1)
+                if found >= 0:
+                    return p + found
+                p += size
+                size *= 2
+            return hi
+        p += 1
+        while p > lo:
+            start = max(p - size, lo)
+            found = cells[start:p].translate(table).rfind(1)
+            if found >= 0:
+                return start + found
+            p = start
+            size *= 2
+        return lo - 1
+
+    def explain(self, tape, state, head, status):
+        '''Human readable reason why a machine in this configuration stopped with this status.'''
+        symbol = tape[head]
+        if status == HALTED:
+            return "halted in final state %s" % self.states[state]
+        if status == STUCK:
+            return "no transition for (%r, %r) at position %d" % (self.states[state], symbol, head)
+        if status == LOOPING:
+            if self.next_state[state * self.stride + tape.code_at(head)] == SPIN:
+                return "(%r, %r) loops in place forever at position %d" % (self.states[state], symbol, head)
+            side = "left" if self.runaway[state] < 0 else "right"
+            return "state %r moves %s over blank forever from position %d" % (self.states[state], side, head)
+        return "step budget exhausted in state %r at position %d" % (self.states[state], head)
+
+
+_compiled = {}
+_machines = {} ## Every machine compiled or unpickled in this process, by digest
+def compile_machine(transition_function, initial_state, final_states, blank="[]"):
+    '''Compiles a machine once and reuses it for every Turing built from the same table.
+    Tables are treated as immutable once compiled.'''
+    key = (id(transition_function), len(transition_function), initial_state, frozenset(final_states), blank)
+    entry = _compiled.get(key)
+    if entry is None or entry[0] is not transition_function:
+        digest = fingerprint(transition_function, initial_state, final_states, blank)
+        if digest not in _machines:
+            _machines[digest] = CompiledMachine(transition_function, initial_state, final_states, blank)
+        entry = (transition_function, _machines[digest])
+        _compiled[key] = entry
+    return entry[1]
+
+
+def find_machine(digest):
+    '''Machine with this digest that was compiled or unpickled in this process.'''
+    if digest not in _machines:
+        raise LookupError("machine %s is not compiled in this process" % digest[:16])
+    return _machines[digest]
+
+
+def _restore_machine(digest, state):
+    if digest not in _machines:
+        machine = CompiledMachine.__new__(CompiledMachine)
+        machine.__dict__.update(state)
+        _machines[digest] = machine
+    return _machines[digest]
@@ -0,0 +1,152 @@
+'''
+This file grades a route in one pass over its tokens, without simulating the tape.
+All the machine really computes is a count: every hold and move leaves some 1s on the tape (Jug,
+Handle, Static and the other X moves leave none), the E states collapse the Xs away, the q and p
+states halve the count for a boulder and the T states quarter it for a tall wall, and the V and 5.
+chains write the grade for what is left. The fold below keeps that count as it reads the route,
+with advance(state, token) per token and finish(state) at the end.
+The tables describe the machine in language.py, so routes for any other machine (by digest) go to
+that machine as they are. Anything else the fold does not cover (a token outside the route language,
+a route the machine rejects) is handed to the Turing Machine, and so is a route long enough that the
+machine might run out of its step budget before accepting it (see steps_bound), so grade returns
+exactly what language.grade returns.
+differential() checks that on random routes.
+'''
+
+import random
+
+import language
+import lexer
+
+
+HOLDS = {"Crimp": 2, "Sloper": 2, "Under cling": 2, ## 1s each hold leaves on the tape
+         "Side cling": 1, "Pocket": 1, "Pinch": 1,
+         "Jug": 0, "Handle": 0}
+MOVES = {"Chimney": 1, "Stem": 1, "Drop knee": 1, "Rock over": 1, "Toe hook": 1, ## 1s each move leaves
+         "Static": 0, "Bump": 0, "Match": 0, "Flag": 0, "Walk through": 0, "Layback": 0,
+         "Mantle": 2, "Barn door": 2, "Gaston": 2, "Deadpoint": 2, "Knee bar": 2, "Heel hook": 2,
+         "Dyno": 3, "Bicycle": 3}
+DIVISORS = {"B": 2, "T": 4} ## By wall
+SWEEPS = frozenset(["Crimp", "Sloper", "Under cling", "Mantle", "Barn door", "Gaston", "Deadpoint",
+                    "Knee bar", "Heel hook", "Dyno", "Bicycle"]) ## Tokens after which the machine sweeps right over the rest of the route
+STALLS = frozenset(["Rock over"]) ## Tokens the sweep states have no transition for
+
+STEPS_PER_TOKEN_SQUARED = 8 ## The slowest routes found take about 5.8 * tokens**2 steps to accept, the rest is margin
+
+START = (None, 0, False, False) ## (wall, 1s so far, whether a hold comes next, whether a sweep happened)
+
+
+def advance(state, token):
+    '''Fold state after one more token, or None if the route leaves what the fold covers.'''
+    wall, ones, hold_next, swept = state
+    if wall == None:
+        if token in DIVISORS:
+            return token, 0, True, False
+        return None
+    if hold_next:
+        count = HOLDS.get(token)
+    elif swept and token in STALLS:
+        return None
+    else:
+        count = MOVES.get(token)
+    if count == None:
+        return None
+    return wall, ones + count, not hold_next, swept or token in SWEEPS
+
+
+def finish(state):
+    '''Grade the machine writes for a route that ended in this fold state, or None if it would not accept it.'''
+    wall, ones, hold_next, swept = state
+    if wall == None or hold_next:
+        return None
+    value = ones // DIVISORS[wall]
+    if wall == "B":
+        return "V10+" if value >= 10 else "V%d" % value
+    return "5.14+" if value >= 8 else "5.%d" % (6 + value)
+
+
+def covers(machine):
+    '''Whether the fold tables describe this machine: only the one in language.py, or a copy of it.'''
+    return machine.digest == language.machine.digest
+
+
+def steps_bound(tokens):
+    '''Most steps the machine takes to accept a route of this many tokens. Routes it can't be sure to
+    accept within the step budget are left to the machine, which then rejects them for running out.'''
+    return STEPS_PER_TOKEN_SQUARED * tokens * tokens + 64
+
+
+def grade(input, max_steps=language.MAX_STEPS, machine=language.machine):
+    '''Same result as language.grade, in O(tokens) for every route the machine accepts within max_steps.'''
+    tokens = input.split("_")
+    if covers(machine) and steps_bound(len(tokens)) <= max_steps:
+        state = START
+        for token in tokens:
+            state = advance(state, token)
+            if state == None:
+                break
+        else:
+            result = finish(state)
+            if result != None:
+                return "Accept", result
+    return language.grade(input, max_steps, machine) ## Rejected or out of the fold: the machine decides and explains
+
+
+def simulate(route, max_steps=language.MAX_STEPS):
+    '''Verdict and grade from a bare Turing simulation, with no lexer in front.'''
+    turing = language.Turing(route, "[]", language.initial_state, language.final_states, language.transition_function, language.machine)
+    turing.run(max_steps)
+    if turing.final():
+        return "Accept", turing.tape[turing.head_position - 1]
+    return "Reject", None
+
+
+def random_route(rng, max_tokens=12, vocabulary=None):
+    '''A random route, mostly in the route language, sometimes with a token dropped, swapped for
+    any symbol of the machine, or misspelled.'''
+    if vocabulary == None:
+        vocabulary = lexer.vocabulary(language.transition_function, language.initial_state)
+    walls, holds, moves = vocabulary
+    tokens = [rng.choice(walls)]
+    for position in range(1, rng.randint(1, max_tokens)):
+        tokens.append(rng.choice(holds if position % 2 else moves))
+    for _ in range(rng.choice((0, 0, 0, 1, 2))):
+        position = rng.randrange(len(tokens))
+        mutation = rng.randrange(3)
+        if mutation == 0 and len(tokens) > 1:
+            del tokens[position]
+        elif mutation == 1:
+            tokens[position] = rng.choice(language.machine.alphabet.symbols[:-1])
+        else:
+            tokens[position] = tokens[position][:-1] or "?"
+    return "_".join(tokens)
+
+
+def differential(count=1000, seed=None, max_tokens=12, max_steps=language.MAX_STEPS):
+    '''Grades count random routes with grade, language.grade and a bare Turing simulation. Returns a list of
+    (route, description) for every route where grade differs from either of them.'''
+    rng = random.Random(seed)
+    vocabulary = lexer.vocabulary(language.transition_function, language.initial_state)
+    mismatches = []
+    for _ in range(count):
+        route = random_route(rng, max_tokens, vocabulary)
+        fast = grade(route, max_steps)
+        expected = language.grade(route, max_steps)
+        if fast != expected:
+            mismatches.append((route, "%r != language.grade %r" % (fast, expected)))
+            continue
+        simulated = simulate(route, max_steps)
+        if fast[0] != simulated[0] or (fast[0] == "Accept" and fast != simulated):
+            mismatches.append((route, "%r != simulation %r" % (fast, simulated)))
+    return mismatches
+
+
+if __name__ == "__main__": ## python formula.py [count [seed]] checks grade against the machine on random routes
+    import sys
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    mismatches = differential(count, seed)
+    for route, description in mismatches:
+        print("%s: %s" % (route, description))
+    print("%d of %d routes differ" % (len(mismatches), count))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,183 @@
+'''
+This file grades routes incrementally, for a route setter who keeps appending or changing tokens, and
+grades batches of routes that share prefixes.
+All the machine carries from a prefix of a route to the rest is the fold state of formula.py (the wall,
+the 1s so far, what comes next and whether a sweep happened), so a Route keeps that state after every
+prefix. Appending a token costs one advance, changing token i folds again only from token i, and
+grading costs one finish, which stands in for the E, q, p and V phases. grade_trie folds a batch along
+a prefix trie, so a prefix shared by many routes is folded once for all of them.
+A route the fold doesn't cover (rejected, outside the route language, or for a machine other than the
+one in language.py, see formula.covers) is graded by the machine from scratch, and so is a route too
+long to be sure the machine accepts it within its step budget (see formula.steps_bound), so every
+result is exactly what language.grade returns.
+    python incremental.py [count [seed]]
+'''
+
+import random
+
+import formula
+import language
+import lexer
+
+
+class Route(object):
+    def __init__(self, route=None, max_steps=language.MAX_STEPS, machine=language.machine):
+        self.tokens = []
+        self.states = [formula.START] ## Fold state after each prefix, up to the first one the fold doesn't cover
+        self.max_steps = max_steps
+        self.machine = machine
+        self.folds = 0 ## Tokens folded so far, what the edits have cost
+        self.result = None ## Grade of the current tokens once known
+        if route != None:
+            self.extend(route.split("_"))
+
+    def __str__(self):
+        return "_".join(self.tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def __getitem__(self, index):
+        return self.tokens[index]
+
+    def _changed(self, index): ## Forgets what depends on the token at index
+        del self.states[index + 1:]
+        self.result = None
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self.tokens)
+        if not 0 <= index < len(self.tokens):
+            raise IndexError("route has no token %d" % index)
+        return index
+
+    def append(self, token):
+        self.tokens.append(token)
+        self.result = None
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+    def pop(self):
+        self._changed(len(self.tokens) - 1)
+        return self.tokens.pop()
+
+    def insert(self, index, token):
+        index = min(max(index + len(self.tokens) if index < 0 else index, 0), len(self.tokens))
+        self._changed(index)
+        self.tokens.insert(index, token)
+
+    def __setitem__(self, index, token):
+        index = self._index(index)
+        self._changed(index)
+        self.tokens[index] = token
+
+    def __delitem__(self, index):
+        index = self._index(index)
+        self._changed(index)
+        del self.tokens[index]
+
+    def fold(self):
+        '''Fold state after every token, or None if the fold doesn't cover the route. Only folds the
+        tokens after the last prefix it already knows.'''
+        states = self.states
+        while len(states) <= len(self.tokens) and states[-1] != None:
+            states.append(formula.advance(states[-1], self.tokens[len(states) - 1]))
+            self.folds += 1
+        return states[-1]
+
+    def grade(self):
+        '''Same result as language.grade(str(self)).'''
+        if self.result == None:
+            state = self.fold()
+            grade = None
+            if state != None and formula.covers(self.machine) and formula.steps_bound(len(self.tokens)) <= self.max_steps:
+                grade = formula.finish(state)
+            if grade != None:
+                self.result = ("Accept", grade)
+            else:
+                self.result = language.grade(str(self), self.max_steps, self.machine) ## The machine decides and explains
+        return self.result
+
+
+def grade_trie(routes, max_steps=language.MAX_STEPS, machine=language.machine):
+    '''Grades routes, folding each distinct prefix once. Returns the results in the order of the routes,
+    the same as language.grade gives for each.'''
+    root = {}
+    for index, route in enumerate(routes):
+        node = root
+        for token in route.split("_"):
+            node = node.setdefault(token, {})
+        node.setdefault(None, []).append(index) ## Routes ending here
+    results = [None] * len(routes)
+    stack = [(root, formula.START if formula.covers(machine) else None, 0)]
+    while stack:
+        node, state, depth = stack.pop()
+        if state != None and formula.steps_bound(depth) > max_steps:
+            state = None ## Too long for the budget, the machine decides
+        for token, child in node.items():
+            if token != None:
+                stack.append((child, None if state == None else formula.advance(state, token), depth + 1))
+            elif state != None:
+                grade = formula.finish(state)
+                if grade != None:
+                    for index in child:
+                        results[index] = ("Accept", grade)
+    rejected = {}
+    for index, route in enumerate(routes):
+        if results[index] == None:
+            if route not in rejected:
+                rejected[route] = language.grade(route, max_steps, machine)
+            results[index] = rejected[route]
+    return results
+
+
+def differential(count=200, seed=None, edits=20, max_tokens=16, max_steps=language.MAX_STEPS):
+    '''Runs count random edit sessions on a Route and grades a batch of every route they went through with
+    grade_trie, checking each result against language.grade. Returns (route, description) per mismatch.'''
+    rng = random.Random(seed)
+    vocabulary = lexer.vocabulary(language.transition_function, language.initial_state)
+    walls, holds, moves = vocabulary
+
+    def token(position): ## Mostly what the route language expects at position, sometimes anything
+        if rng.random() < 0.1:
+            return rng.choice(rng.choice(vocabulary))
+        return rng.choice(walls if position == 0 else holds if position % 2 else moves)
+
+    mismatches = []
+    seen = []
+    for _ in range(count):
+        route = Route(formula.random_route(rng, max_tokens, vocabulary), max_steps)
+        for _ in range(edits):
+            edit = rng.randrange(4)
+            if edit == 0 or len(route) < 2:
+                route.append(token(len(route)))
+            elif edit == 1:
+                route.pop()
+            elif edit == 2:
+                position = rng.randrange(len(route))
+                route[position] = token(position)
+            else:
+                position = rng.randrange(len(route))
+                route.insert(position, token(position))
+            expected = language.grade(str(route), max_steps)
+            if route.grade() != expected:
+                mismatches.append((str(route), "%r != language.grade %r" % (route.grade(), expected)))
+            seen.append(str(route))
+    for route, result in zip(seen, grade_trie(seen, max_steps)):
+        expected = language.grade(route, max_steps)
+        if result != expected:
+            mismatches.append((route, "grade_trie %r != language.grade %r" % (result, expected)))
+    return mismatches
+
+
+if __name__ == "__main__": ## python incremental.py [count [seed]] checks edit sessions and a trie batch against the machine
+    import sys
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    mismatches = differential(count, seed)
+    for route, description in mismatches:
+        print("%s: %s" % (route, description))
+    print("%d mismatches in %d edit sessions" % (len(mismatches), count))
+    sys.exit(1 if mismatches else 0)
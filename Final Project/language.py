@@ -3,39 +3,25 @@ This file defines a Turing Machine, then a set of states and transitions to simu
 The language is represented by initial_state, final_states, accepting_states, and transition_function.
 It is then simulated by putting this tuple into the Turing Machine. 
 If the final state is reached, the output is printed and the grade can be found in the tape.
-If the final state is not reached, the machine will hang and run forever.
+If the final state is not reached, the machine halts as soon as it has no transition, provably loops,
+or runs out of its step budget, and the input is rejected with the reason.
 This program also runs three test cases to show some of the possible outputs, and
 to run more test cases the user can change the value of the input_string.
 You can also just run with the accept function to see if the input is accepted or not.
 '''
 
 
-class Tape(object):
-    blank = "[]" ## Blank character
-    def __init__(self, string=""): ## Break string into a list of the characters in alphabet
-        self.tape = dict(enumerate(string.split('_')))
-    
-    def __str__(self): ## Return the string of the tape
-        s = ""
-        for char in self.tape.values():
-            s += char
-            s += " "
-        return s
-    
-    def __getitem__(self, index): ## Get the character at the index
-        if index in self.tape:
-            return self.tape[index]
-        return Tape.blank
-    
-    def __setitem__(self, index, value): ## Set the character at the index
-        self.tape[index] = value
-    
+from engine import Tape, compile_machine, find_machine, RUNNING
+from lexer import RouteError, lexer_for
+from tracing import Trace
+from profiling import Profile, Tee
+import codegen
+import artifact
+
+
 class Turing(object):
-    def __init__(self, tape="", blank=" ", initial_state="", final_states=None, transition_function=None):
-        self.tape = Tape(tape)
-        self.head_position = 0
+    def __init__(self, tape="", blank=" ", initial_state="", final_states=None, transition_function=None, machine=None):
         self.blank = blank
-        self.current_state = initial_state
         if transition_function == None:
             self.transition_function = {}
         else:
@@ -44,26 +30,120 @@ class Turing(object):
             self.final_states = set()
         else:
             self.final_states = set(final_states)
+        if machine == None: ## An already compiled machine can be passed in to skip the compile cache
+            machine = compile_machine(self.transition_function, initial_state, self.final_states, Tape.blank)
+        self.machine = machine
+        self.backend = machine ## What run steps with: the compiled machine, or its generated code (see use_backend)
+        if isinstance(tape, Tape): ## Already interned, e.g. by lexer.Lexer.tape
+            self.tape = tape
+        else:
+            self.tape = Tape(tape, self.machine.alphabet)
+        self.head_position = 0
+        self.state = self.machine.state_codes[initial_state] ## Interned code of the current state
+        self.trace = None ## Trace recording every step, see start_trace
+        self.profile = None ## Profile counting every step, see start_profile
+        self.status = RUNNING ## Why the last run stopped, see engine.py
+
+    @property
+    def current_state(self):
+        return self.machine.states[self.state]
+
+    @current_state.setter
+    def current_state(self, state):
+        self.state = self.machine.state_codes[state]
     
     def get_tape(self):
         return str(self.tape)
     
+    def start_trace(self, checkpoint_every=1024, path=None):
+        '''Starts recording every following step in a compact Trace, streamed to path if given.'''
+        self.trace = Trace(self.machine, self.tape, self.state, self.head_position, checkpoint_every, path)
+        return self.trace
+
+    def start_profile(self):
+        '''Starts profiling every following step (off by default, and free while off). Returns the Profile.'''
+        self.profile = Profile(self.machine, self.tape)
+        return self.profile
+
+    def recorder(self): ## What the engine reports steps to: the trace, the profile, both, or nothing
+        if self.profile == None:
+            return self.trace
+        if self.trace == None:
+            return self.profile
+        return Tee(self.trace, self.profile)
+
+    def use_backend(self, backend):
+        '''Chooses how run executes: "interpreter" steps through the compiled table, "codegen" runs
+        Python generated from it (see codegen.py). Both give the same results and traces.'''
+        if backend == "codegen":
+            self.backend = codegen.load(self.machine)
+        elif backend == "interpreter":
+            self.backend = self.machine
+        else:
+            raise ValueError("unknown backend %r" % backend)
+
+    def slices(self, k, max_steps=None):
+        '''Runs k steps at a time, yielding the steps taken so far after each slice, until the machine
+        can't go on or max_steps steps have been taken. Between slices the Turing is paused: it can
+        be left alone, dropped to cancel it, or pickled and resumed somewhere else.'''
+        if k < 1:
+            raise ValueError("slices need at least 1 step, got %r" % k)
+        return self._slices(k, max_steps)
+
+    def _slices(self, k, max_steps):
+        taken = 0
+        while not self.halted() and (max_steps == None or taken < max_steps):
+            taken += self.run(k if max_steps == None else min(k, max_steps - taken))
+            yield taken
+
+    def __getstate__(self):
+        '''A paused Turing pickles as just its configuration: the machine by digest, the state, the head,
+        and the written region of the tape. The machine has to be compiled in the process that unpickles
+        it (the one in this file always is). Traces and profiles stay behind.'''
+        return {"machine": self.machine.digest, "codegen": self.backend is not self.machine, "blank": self.blank,
+                "state": self.state, "head": self.head_position, "status": self.status,
+                "tape": self.tape.snapshot(), "foreign": self.tape.foreign}
+
+    def __setstate__(self, config):
+        self.machine = find_machine(config["machine"])
+        self.blank = config["blank"]
+        self.transition_function = self.machine.transition_function
+        self.final_states = set(self.machine.final_states)
+        self.backend = self.machine
+        if config["codegen"]:
+            self.use_backend("codegen")
+        self.tape = Tape.restore(self.machine.alphabet, config["tape"], config["foreign"])
+        self.head_position = config["head"]
+        self.state = config["state"]
+        self.status = config["status"]
+        self.trace = None
+        self.profile = None
+
     def step(self):
-        head_symbol = self.tape[self.head_position]
-        x = (self.current_state, head_symbol)
-        if x in self.transition_function:
-            y = self.transition_function[x]
-            self.tape[self.head_position] = y[1]
-            if y[2] == "R":
-                self.head_position += 1
-            elif y[2] == "L":
-                self.head_position -= 1
-            self.current_state = y[0]
+        if self.profile != None:
+            self.profile.resume(self.state)
+        self.state, self.head_position, self.status = self.machine.step(self.tape, self.state, self.head_position, self.recorder())
+        if self.profile != None:
+            self.profile.pause()
+
+    def run(self, max_steps):
+        '''Runs up to max_steps steps on the compiled table, stopping early on a final state, a missing transition,
+        or a provable loop. Returns the number of steps taken, self.status says why it stopped.'''
+        if self.profile != None:
+            self.profile.resume(self.state)
+        self.state, self.head_position, steps, self.status = self.backend.run(self.tape, self.state, self.head_position, max_steps, self.recorder())
+        if self.profile != None:
+            self.profile.pause()
+        return steps
         
     def final(self):
-        if self.current_state in self.final_states:
-            return True
-        return False
+        return self.machine.final[self.state] == 1
+
+    def halted(self): ## True once the machine can't take another step
+        return self.status != RUNNING
+
+    def reject_reason(self):
+        return self.machine.explain(self.tape, self.state, self.head_position, self.status)
 
 alphabet = ("tall wall vs boulder; moves: mantle, barn door, chimney, dyno, static, stem, drop knee, gaston, flag, rock over, walk through, match, layback, heel hook, toe hook, bicycle, deadpoint, knee bar; holds: crimp, sloper, jug, handle, side cling, under cling, pinch, pocket")
 initial_state = "Start"
@@ -430,6 +510,7 @@ transition_function = {("Start", "B"): ("H", "B", "R"),
 }
 
 data_structure = ("Some input string", "[]", initial_state, final_states, transition_function)
+machine = artifact.machine_for(transition_function, initial_state, final_states, Tape.blank) ## Mapped from __pycache__ once it was compiled
 ## Note: The alphabet is not explicitly defined here; for testing, it's easier to use the input string and
 ## let the transition function take care of the alphabet. This is more using the flexibility of Python
 ## than anything else, and the implementation could be changed to include an alphabet if desired.
@@ -459,20 +540,45 @@ def main():
     print(accept(input))
 
 
-import time
-def accept(input):
-    '''Takes the turing machine, returns Accept and the Path if the input is accepted, or Reject if not.
-    Turing machine hangs, doesn't reject, so adding timer to reject after too much time.'''
+MAX_STEPS = 10 ** 10 ## Default step budget. Steps grow with the square of the route, a 10,000-token route takes about 1.4 * 10**8, so this covers routes up to about 80,000 tokens
+
+def accept(input, max_steps=MAX_STEPS, trace_path=None, machine=machine, backend="interpreter"):
+    '''Takes the turing machine, returns Accept and the Path if the input is accepted, or Reject and the reason if not.
+    The path is a Trace: iterating it gives the (state, tape, head) of every step, rebuilt on demand from
+    per-step deltas. Pass trace_path to stream it to a file instead of keeping it in memory; the caller then
+    owns the open file and closes it with the Trace (path.close() or a with block). Rejected runs close it here.
+    The machine rejects as soon as it has no transition or provably never halts, and otherwise after max_steps steps.
+    Routes the lexer can tell are malformed are rejected without running the machine.'''
+    accept_path = None
+    try:
+        turing = Turing(lexer_for(machine).tape(input), "[]", initial_state, final_states, transition_function, machine)
+        turing.use_backend(backend)
+        accept_path = turing.start_trace(path=trace_path) ## Tracks the path
+        turing.run(max_steps)
+        if turing.final():
+            return "Accept", accept_path ## Note: the path is almost certainly going to be very long due to the nature of the machine
+        accept_path.close() ## Nobody gets this path, so its file is closed here
+        return "Reject", turing.reject_reason()
+    except RouteError as error:
+        return "Reject", str(error)
+    except:
+        if accept_path != None:
+            accept_path.close()
+        return "Reject", []
+
+
+def grade(input, max_steps=MAX_STEPS, machine=machine, backend="interpreter"):
+    '''Same verdict as accept, but without recording the path. Returns Accept and the grade the machine
+    wrote on the tape (e.g. "V4" or "5.7"), or Reject and the reason.'''
     try:
-        turing = Turing(input, "[]", initial_state, final_states, transition_function)
-        accept_path = []
-        start = time.time()
-        while not turing.final():
-            accept_path.append((turing.current_state, turing.get_tape(), turing.head_position)) ## Tracks the path
-            turing.step()
-            if time.time() - start > 5: ## Premature reject rather than hang. If on slow computer may need to increase
-                return "Reject"
-        return "Accept", accept_path ## Note: the path is almost certainly going to be very long due to the nature of the machine
+        turing = Turing(lexer_for(machine).tape(input), "[]", initial_state, final_states, transition_function, machine)
+        turing.use_backend(backend)
+        turing.run(max_steps)
+        if turing.final():
+            return "Accept", turing.tape[turing.head_position - 1] ## The End transitions write the grade and move right
+        return "Reject", turing.reject_reason()
+    except RouteError as error:
+        return "Reject", str(error)
     except:
         return "Reject", []
 
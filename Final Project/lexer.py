@@ -0,0 +1,117 @@
+'''
+This file checks and interns a route before the Turing Machine ever sees it.
+The token classes come from the transition function itself: walls are what the initial state reads,
+holds what the state after it reads, and moves what the states after a hold read, less the symbols
+the machine writes itself. One pass over the tokens interns each one and checks the grammar the
+Start, H and M states encode, wall hold (move hold)*, so a misspelled token or a malformed route is
+rejected right away with its position instead of after a run of the machine.
+Only routes the machine is sure to reject are refused. A route holding one of the machine's own
+working symbols (a blank, 1, X or a second wall) past the first hold can still be accepted by it,
+so the grammar past the first hold is only enforced on routes without any of them.
+'''
+
+from engine import Tape
+
+
+## Token classes, by symbol code
+WORK = 0    ## Written or read by the machine itself, not part of the route language
+WALL = 1
+HOLD = 2
+MOVE = 3
+UNKNOWN = 4 ## Not in the alphabet at all
+
+NAMES = {HOLD: "a hold", MOVE: "a move"}
+
+
+class RouteError(ValueError):
+    '''A route the machine is sure to reject. position is the index of the offending token
+    (the route's length if a token is missing at the end) and column its offset in the route text
+    (the length of the text for a missing token).'''
+    def __init__(self, message, route, position):
+        tokens = route.split("_")[:position]
+        self.route = route
+        self.position = position
+        self.column = min(sum(len(token) + 1 for token in tokens), len(route))
+        ValueError.__init__(self, "%s at position %d" % (message, position))
+
+
+def vocabulary(transition_function, initial_state, blank="[]"):
+    '''(walls, holds, moves) of the route language, each sorted.'''
+    rows = {}
+    for (state, symbol), (following, _, _) in transition_function.items():
+        rows.setdefault(state, {})[symbol] = following
+    marks = set(write for (state, symbol), (_, write, _) in transition_function.items() if write != symbol)
+    walls = set(rows[initial_state])
+    hold_states = set(rows[initial_state].values())
+    holds = set().union(*[rows[state] for state in hold_states])
+    move_states = set().union(*[set(rows[state].values()) for state in hold_states]) - hold_states
+    moves = set().union(*[rows.get(state, {}) for state in move_states]) - walls - holds - marks - {blank}
+    return sorted(walls), sorted(holds), sorted(moves)
+
+
+class Lexer(object):
+    def __init__(self, machine):
+        self.machine = machine
+        self.alphabet = machine.alphabet
+        self.walls, self.holds, self.moves = vocabulary(machine.transition_function, machine.initial_state, machine.alphabet.blank)
+        self.kinds = bytearray(len(self.alphabet)) ## Symbol code -> token class
+        for kind, symbols in ((WALL, self.walls), (HOLD, self.holds), (MOVE, self.moves)):
+            for symbol in symbols:
+                self.kinds[self.alphabet.code(symbol)] = kind
+        self.kinds[self.alphabet.foreign] = UNKNOWN
+
+    def tokenize(self, route):
+        '''Interned codes of the route's tokens, in a tape buffer. Raises RouteError if the machine
+        would reject the route. Tokens outside the alphabet get the foreign code.'''
+        tokens = route.split("_")
+        codes = self.alphabet.buffer(len(tokens))
+        get = self.alphabet.codes.get
+        foreign = self.alphabet.foreign
+        kinds = self.kinds
+        expected = (WALL, HOLD, MOVE, HOLD) ## By position, then the last two alternate
+        error = None ## First token breaking the grammar past the first hold
+        working = False ## Whether a working symbol shows up, see the top of the file
+        for position, token in enumerate(tokens):
+            code = get(token, foreign)
+            codes[position] = code
+            kind = kinds[code]
+            if kind != expected[position if position < 2 else 2 + position % 2]:
+                if kind == WORK or (kind == WALL and position):
+                    working = True
+                if position < 2:
+                    raise self._error(kind, position, route, token)
+                if error == None:
+                    error = (kind, position, token)
+        if not working:
+            if error != None:
+                kind, position, token = error
+                raise self._error(kind, position, route, token)
+            if len(tokens) % 2:
+                raise RouteError("route ends without a hold", route, len(tokens))
+        return codes
+
+    def _error(self, kind, position, route, token):
+        if kind == UNKNOWN:
+            return RouteError("unknown token %r" % token, route, position)
+        if position == 0:
+            expected = " or ".join(self.walls)
+        else:
+            expected = NAMES[HOLD if position % 2 else MOVE]
+        return RouteError("expected %s, got %r" % (expected, token), route, position)
+
+    def tape(self, route):
+        '''Tape holding the route, after checking it like tokenize.'''
+        codes = self.tokenize(route)
+        foreign = None
+        if self.alphabet.foreign in codes:
+            foreign = dict((position, token) for position, token in enumerate(route.split("_"))
+                           if self.alphabet.code(token) == self.alphabet.foreign)
+        return Tape.restore(self.alphabet, (0, codes), foreign)
+
+
+_lexers = {}
+def lexer_for(machine):
+    '''Lexer of a compiled machine, built once per machine.'''
+    if machine.digest not in _lexers:
+        _lexers[machine.digest] = Lexer(machine)
+    return _lexers[machine.digest]
@@ -0,0 +1,146 @@
+'''
+This file runs many copies of the Turing Machine in lockstep with NumPy.
+M machines are held as integer arrays: a state vector, a head vector, and an M x width tape matrix.
+Each step advances every machine that is still running with one gather into the compiled transition
+table and one scatter of the written symbols, and machines that halted are dropped from the active set.
+The verdicts and grades are the same ones language.grade gives; it pays off on large batches of routes
+of similar length, where the per-step cost is shared by the whole batch.
+NumPy is only needed for this backend.
+'''
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from engine import Tape, RUNNING, HALTED, STUCK, LOOPING, MISSING
+from lexer import RouteError, lexer_for
+import language
+
+
+PAD = 16 ## Spare blank columns on each side of the tape matrix when it is built or grown
+
+
+class Lockstep(object):
+    def __init__(self, machine=None):
+        if numpy == None:
+            raise ImportError("the lockstep backend needs numpy")
+        if machine == None:
+            machine = language.machine
+        self.machine = machine
+        self.cell_type = numpy.uint8 if machine.stride <= 256 else numpy.uint16
+        self.next_state = numpy.array(machine.next_state, dtype=numpy.int32)
+        self.write = numpy.array(machine.write, dtype=self.cell_type)
+        self.delta = numpy.array(machine.delta, dtype=numpy.int64)
+        self.final = numpy.array(machine.final, dtype=bool)
+        self.runaway = numpy.array(machine.runaway, dtype=numpy.int8)
+        self.steps = None ## Steps each machine of the last run took
+
+    def load(self, routes):
+        '''Encodes the routes into a tape matrix. Returns (tapes, lengths, foreign text by row,
+        reason by row). Routes the lexer rejects get an empty row and their reason.'''
+        alphabet = self.machine.alphabet
+        lexer = lexer_for(self.machine)
+        rows = []
+        foreign = {}
+        rejected = {}
+        for row, route in enumerate(routes):
+            try:
+                codes = lexer.tokenize(route)
+            except RouteError as error:
+                rejected[row] = str(error)
+                codes = alphabet.buffer(0)
+            if alphabet.foreign in codes:
+                for index, char in enumerate(route.split('_')):
+                    if codes[index] == alphabet.foreign:
+                        foreign.setdefault(row, {})[index] = char
+            rows.append(codes)
+        width = max([len(codes) for codes in rows] + [0])
+        tapes = numpy.zeros((len(rows), PAD + width + PAD), dtype=self.cell_type)
+        for row, codes in enumerate(rows):
+            tapes[row, PAD:PAD + len(codes)] = numpy.frombuffer(codes, dtype=self.cell_type)
+        lengths = numpy.array([len(codes) for codes in rows], dtype=numpy.int64)
+        return tapes, lengths, foreign, rejected
+
+    def run(self, routes, max_steps=language.MAX_STEPS):
+        '''Runs every route for at most max_steps steps. Returns a list of ("Accept", grade) or
+        ("Reject", reason), in the order of the routes.'''
+        routes = list(routes)
+        tapes, hi, foreign, rejected = self.load(routes)
+        count = len(routes)
+        offset = PAD ## Column of tape index 0
+        stride = self.machine.stride
+        state = numpy.zeros(count, dtype=numpy.int64) ## Initial state is always code 0
+        head = numpy.zeros(count, dtype=numpy.int64)
+        lo = numpy.zeros(count, dtype=numpy.int64) ## Written region of each tape is lo:hi
+        steps = numpy.zeros(count, dtype=numpy.int64)
+        status = numpy.full(count, RUNNING, dtype=object)
+        status[self.final[state]] = HALTED
+        running = ~self.final[state]
+        running[list(rejected)] = False
+        active = numpy.nonzero(running)[0]
+        taken = 0
+        while active.size and taken < max_steps:
+            if taken % PAD == 0: ## Heads move one cell per step, so keep PAD spare columns on both sides
+                h = head[active]
+                if h.min() + offset < PAD or h.max() + offset >= tapes.shape[1] - PAD:
+                    grow = tapes.shape[1] + PAD
+                    tapes = numpy.pad(tapes, ((0, 0), (grow, grow)))
+                    offset += grow
+                cells = tapes.reshape(-1)
+                base = active * tapes.shape[1] + offset ## Flat index of tape index 0 of each active row
+            h = head[active]
+            s = state[active]
+            flat = base + h
+            t = s * stride + cells[flat]
+
+            ## Stop machines with no transition or that provably loop, like CompiledMachine.run
+            nxt = self.next_state[t]
+            stop = nxt < 0
+            direction = self.runaway[s]
+            runaway = direction != 0
+            if runaway.any():
+                left = h < lo[active]
+                runaway &= ((direction < 0) & left) | ((direction > 0) & (h >= hi[active]))
+                stop |= runaway
+            if stop.any():
+                stopped = active[stop]
+                status[stopped] = numpy.where(nxt[stop] == MISSING, STUCK, LOOPING)
+                steps[stopped] = taken
+                keep = ~stop
+                active, base, flat, h, t, nxt = active[keep], base[keep], flat[keep], h[keep], t[keep], nxt[keep]
+
+            cells[flat] = self.write[t]
+            lo[active] = numpy.minimum(lo[active], h)
+            hi[active] = numpy.maximum(hi[active], h + 1)
+            head[active] = h + self.delta[t]
+            state[active] = nxt
+            taken += 1
+
+            done = self.final[nxt]
+            if done.any():
+                status[active[done]] = HALTED
+                steps[active[done]] = taken
+                keep = ~done
+                active, base = active[keep], base[keep]
+        steps[active] = taken
+
+        self.steps = steps
+        results = []
+        for row in range(count):
+            if row in rejected:
+                results.append(("Reject", rejected[row]))
+            elif status[row] == HALTED:
+                results.append(("Accept", self.machine.alphabet.symbols[tapes[row, head[row] - 1 + offset]]))
+            else:
+                cells = self.machine.alphabet.buffer(0)
+                cells.extend(tapes[row, lo[row] + offset:hi[row] + offset].tolist())
+                tape = Tape.restore(self.machine.alphabet, (int(lo[row]), cells), foreign.get(row))
+                reason = self.machine.explain(tape, int(state[row]), int(head[row]), status[row])
+                results.append(("Reject", reason))
+        return results
+
+
+def grade_many(routes, max_steps=language.MAX_STEPS, machine=None):
+    '''Grades a batch of routes in lockstep. Same results as calling language.grade on each route.'''
+    return Lockstep(machine).run(routes, max_steps)
@@ -0,0 +1,216 @@
+'''
+This file analyses a transition table when it is loaded and rewrites it smaller.
+The sweep states (H1, H2, H3, M1 to M4) each list the same couple of dozen symbols with the same
+action, so each state's row is rewritten as one "any symbol except" rule for its most common action
+plus the few symbols that do something else. On top of that the pass drops states the initial state
+can't reach, merges states that behave the same on every symbol (partition refinement), and reports
+states that can never reach a final state and the symbols a sweep state has no transition for even
+though other states read them, like ("H1", "Rock over"), which only M handles.
+The optimized table is an ordinary transition function again (see WildcardTable.expand), so the
+engine runs it like any other, and equivalent() checks it against the original on generated routes.
+    python optimizer.py [count]
+'''
+
+from collections import Counter
+import json
+import random
+
+from engine import compile_machine, Tape
+import language
+
+
+SAME = None ## Written in place of an action's symbol: write back the symbol that was read
+
+
+def _action(symbol, transition):
+    following, write, move = transition
+    return following, SAME if write == symbol else write, move
+
+
+class WildcardTable(object):
+    '''A transition table as, per state, an optional default action for "any symbol except" the
+    excepted ones, and explicit actions for the symbols that differ. Symbols are those the original
+    table reads, so expanding it gives back exactly the same table.'''
+    def __init__(self, transition_function):
+        self.symbols = set(symbol for (_, symbol) in transition_function)
+        rows = {}
+        for (state, symbol), transition in transition_function.items():
+            rows.setdefault(state, {})[symbol] = _action(symbol, transition)
+        self.rules = {} ## state -> (default action or None, excepted symbols, {symbol: action})
+        for state, row in rows.items():
+            action, hits = Counter(row.values()).most_common(1)[0]
+            excepted = frozenset(self.symbols - set(row))
+            if hits <= 1 + len(excepted): ## Listing the exceptions would cost more than it saves
+                self.rules[state] = (None, frozenset(), row)
+            else:
+                self.rules[state] = (action, excepted, dict((symbol, other) for symbol, other in row.items() if other != action))
+
+    def size(self):
+        '''Entries needed to write the table down: rules plus the symbols they list as exceptions.'''
+        return sum((default != None) + len(excepted) + len(explicit) for default, excepted, explicit in self.rules.values())
+
+    def expand(self):
+        '''The table as an ordinary transition function.'''
+        transition_function = {}
+        for state, (default, excepted, explicit) in self.rules.items():
+            for symbol in self.symbols:
+                if symbol in explicit:
+                    action = explicit[symbol]
+                elif default != None and symbol not in excepted:
+                    action = default
+                else:
+                    continue
+                following, write, move = action
+                transition_function[state, symbol] = (following, symbol if write == SAME else write, move)
+        return transition_function
+
+
+def _successors(transition_function):
+    successors = {}
+    for (state, _), (following, _, _) in transition_function.items():
+        successors.setdefault(state, set()).add(following)
+    return successors
+
+
+def _closure(starts, edges):
+    seen = set(starts)
+    stack = list(starts)
+    while stack:
+        for following in edges.get(stack.pop(), ()):
+            if following not in seen:
+                seen.add(following)
+                stack.append(following)
+    return seen
+
+
+def states_of(transition_function, initial_state, final_states):
+    states = set([initial_state]) | set(final_states)
+    for (state, _), (following, _, _) in transition_function.items():
+        states.add(state)
+        states.add(following)
+    return states
+
+
+def unreachable(transition_function, initial_state, final_states):
+    '''States the initial state has no path of transitions to.'''
+    states = states_of(transition_function, initial_state, final_states)
+    return states - _closure([initial_state], _successors(transition_function))
+
+
+def dead(transition_function, initial_state, final_states):
+    '''States with no path of transitions to a final state: a machine in one never accepts.'''
+    predecessors = {}
+    for state, following in _successors(transition_function).items():
+        for other in following:
+            predecessors.setdefault(other, set()).add(state)
+    states = states_of(transition_function, initial_state, final_states)
+    return states - _closure(final_states, predecessors)
+
+
+def minimize(transition_function, initial_state, final_states):
+    '''Merges states that act the same on every symbol, by partition refinement. Returns the new table
+    and a dict from every state to the one that now stands for it.'''
+    states = sorted(states_of(transition_function, initial_state, final_states), key=lambda state: (state != initial_state, str(state)))
+    symbols = sorted(set(symbol for (_, symbol) in transition_function), key=str)
+    block = dict((state, state in final_states) for state in states)
+    while True:
+        signatures = {}
+        refined = {}
+        for state in states:
+            row = []
+            for symbol in symbols:
+                transition = transition_function.get((state, symbol))
+                if transition == None:
+                    row.append(None)
+                else:
+                    following, write, move = _action(symbol, transition)
+                    row.append((block[following], write, move))
+            refined[state] = signatures.setdefault((block[state], tuple(row)), len(signatures))
+        if len(signatures) == len(set(block.values())):
+            break
+        block = refined
+    representative = {}
+    for state in states:
+        representative.setdefault(block[state], state) ## The first state of each block, the initial state first
+    merged = dict((state, representative[block[state]]) for state in states)
+    table = {}
+    for (state, symbol), (following, write, move) in transition_function.items():
+        if merged[state] == state:
+            table[state, symbol] = (merged[following], write, move)
+    return table, merged
+
+
+def missing(table, transition_function):
+    '''(state, symbol, states that read it) for each symbol a wildcard state excepts although other
+    states read it: a tape holding that symbol stalls the machine in that state.'''
+    readers = {}
+    for (state, symbol) in transition_function:
+        readers.setdefault(symbol, set()).add(state)
+    found = []
+    for state, (default, excepted, _) in sorted(table.rules.items()):
+        for symbol in sorted(excepted):
+            found.append((state, symbol, sorted(readers[symbol])))
+    return found
+
+
+class Optimization(object):
+    def __init__(self, transition_function=language.transition_function, initial_state=language.initial_state,
+                 final_states=language.final_states):
+        self.original = transition_function
+        self.initial_state = initial_state
+        self.final_states = set(final_states)
+        self.unreachable = unreachable(transition_function, initial_state, final_states)
+        self.dead = dead(transition_function, initial_state, final_states)
+        reachable = dict((key, transition) for key, transition in transition_function.items() if key[0] not in self.unreachable)
+        self.table, self.merged = minimize(reachable, initial_state, self.final_states)
+        self.wildcard = WildcardTable(self.table)
+        self.missing = missing(self.wildcard, self.table)
+
+    def compile(self):
+        '''Compiled machine of the optimized table, ready for Turing or language.grade.'''
+        return compile_machine(self.wildcard.expand(), self.initial_state, self.final_states, Tape.blank)
+
+    def report(self):
+        original = len(self.original)
+        states = len(states_of(self.original, self.initial_state, self.final_states))
+        optimized = len(states_of(self.table, self.initial_state, self.final_states))
+        return {"transitions": original, "optimized_transitions": len(self.table),
+                "wildcard_entries": self.wildcard.size(),
+                "reduction": 1.0 - self.wildcard.size() / float(original) if original else 0.0,
+                "states": states, "optimized_states": optimized,
+                "unreachable": sorted(self.unreachable, key=str), "dead": sorted(self.dead, key=str),
+                "merged": dict((state, into) for state, into in sorted(self.merged.items(), key=str) if state != into),
+                "missing": ["(%r, %r) is read by %s%s" % (state, symbol, ", ".join(readers[:4]),
+                                                            " and %d more" % (len(readers) - 4) if len(readers) > 4 else "")
+                            for state, symbol, readers in self.missing]}
+
+    def equivalent(self, routes=None, count=2000, seed=0, max_steps=language.MAX_STEPS):
+        '''Runs the routes (count random ones by default) on the original and the optimized table.
+        Returns (route, description) for every route where the verdict, grade, steps or final tape differ.'''
+        if routes == None:
+            import formula
+            rng = random.Random(seed)
+            routes = [formula.random_route(rng, 24) for _ in range(count)]
+        original = compile_machine(self.original, self.initial_state, self.final_states, Tape.blank)
+        optimized = self.compile()
+        mismatches = []
+        for route in routes:
+            runs = []
+            for machine in (original, optimized):
+                turing = language.Turing(route, "[]", self.initial_state, self.final_states, machine.transition_function, machine)
+                steps = turing.run(max_steps)
+                runs.append((turing.final(), turing.get_tape(), turing.head_position, steps))
+            if runs[0] != runs[1]:
+                mismatches.append((route, "%r != %r" % tuple(runs)))
+        return mismatches
+
+
+if __name__ == "__main__": ## python optimizer.py [count] prints the report and checks count random routes
+    import sys
+    optimization = Optimization()
+    print(json.dumps(optimization.report(), indent=2))
+    mismatches = optimization.equivalent(count=int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
+    for route, description in mismatches:
+        print("%s: %s" % (route, description))
+    print("optimized table %s on the corpus" % ("differs" if mismatches else "is equivalent"))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,123 @@
+'''
+This file profiles where the Turing Machine spends its steps.
+A Profile plugs into the same record hook the Trace uses, so a Turing without one pays nothing.
+It counts steps per state and hits per transition (sweeps are counted cell by cell), times each
+phase group of the machine, and tracks how far the tape grew. Results come out as a dict, JSON,
+or flamegraph-style collapsed stacks ("phase;state;symbol count" per line).
+'''
+
+from collections import Counter
+import json
+import time
+
+
+## Phase groups of the grading machine, by state name prefix. The first match wins, so grade comes
+## first to keep End out of the E states.
+PHASES = (("grade", ("V", "5.", "End")),    ## Writing out the grade
+          ("count", ("Start", "H", "M")),   ## Reading holds and moves into 1s and Xs
+          ("collapse", ("E",)),             ## Collapsing the Xs away
+          ("divide", ("q", "p", "T")))      ## Halving for boulders, quartering for tall walls
+
+
+def phase_of(state):
+    for phase, prefixes in PHASES:
+        if str(state).startswith(prefixes):
+            return phase
+    return "other"
+
+
+class Profile(object):
+    def __init__(self, machine, tape):
+        self.machine = machine
+        self.tape = tape
+        self.phases = [phase_of(state) for state in machine.states]
+        self.state_steps = Counter() ## state code -> steps
+        self.transition_hits = Counter() ## (state code, symbol code) -> hits
+        self.phase_time = Counter() ## phase -> seconds
+        self.steps = 0
+        self.max_extent = len(tape)
+        self.phase = None ## Phase being timed, None while paused
+        self.since = 0.0
+
+    def resume(self, state): ## Start the clock again for the phase of state
+        self.phase = self.phases[state]
+        self.since = time.perf_counter()
+
+    def pause(self):
+        if self.phase != None:
+            self.phase_time[self.phase] += time.perf_counter() - self.since
+            self.phase = None
+        self.max_extent = max(self.max_extent, len(self.tape))
+
+    def record(self, state, head, old, new, sweep=0):
+        '''Same hook as Trace.record. Called before the step writes, so the tape still holds the old cells.'''
+        phase = self.phases[state]
+        if phase != self.phase:
+            now = time.perf_counter()
+            if self.phase != None:
+                self.phase_time[self.phase] += now - self.since
+            self.phase = phase
+            self.since = now
+        if sweep:
+            i = head + self.tape.offset
+            if sweep > 0:
+                swept = self.tape.cells[i:i + sweep]
+            else:
+                swept = self.tape.cells[i + sweep + 1:i + 1]
+            for symbol, hits in Counter(swept).items():
+                self.transition_hits[state, symbol] += hits
+            self.state_steps[state] += abs(sweep)
+            self.steps += abs(sweep)
+        else:
+            self.transition_hits[state, old] += 1
+            self.state_steps[state] += 1
+            self.steps += 1
+
+    def summary(self):
+        '''Everything collected so far as a plain dict.'''
+        states = self.machine.states
+        symbols = self.machine.alphabet.symbols
+        phase_steps = Counter()
+        for state, steps in self.state_steps.items():
+            phase_steps[self.phases[state]] += steps
+        return {"steps": self.steps,
+                "states": dict((states[state], steps) for state, steps in self.state_steps.most_common()),
+                "transitions": dict(("%s,%s" % (states[state], symbols[symbol]), hits)
+                                    for (state, symbol), hits in self.transition_hits.most_common()),
+                "phase_seconds": dict(self.phase_time),
+                "phase_steps": dict(phase_steps),
+                "max_tape_extent": max(self.max_extent, len(self.tape))}
+
+    def to_json(self, indent=None):
+        return json.dumps(self.summary(), indent=indent)
+
+    def collapsed(self):
+        '''Flamegraph collapsed-stack text, one "phase;state;symbol steps" line per transition.'''
+        states = self.machine.states
+        symbols = self.machine.alphabet.symbols
+        lines = []
+        for (state, symbol), hits in sorted(self.transition_hits.items()):
+            lines.append("%s;%s;%s %d" % (self.phases[state], states[state], symbols[symbol], hits))
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+class Tee(object):
+    '''Sends every record to both a trace and a profile.'''
+    def __init__(self, *recorders):
+        self.recorders = recorders
+
+    def record(self, state, head, old, new, sweep=0):
+        for recorder in self.recorders:
+            recorder.record(state, head, old, new, sweep)
+
+
+if __name__ == "__main__": ## python profiling.py route [--collapsed]
+    import sys
+    import language
+    turing = language.Turing(sys.argv[1], "[]", language.initial_state, language.final_states, language.transition_function)
+    profile = turing.start_profile()
+    turing.run(language.MAX_STEPS)
+    if "--collapsed" in sys.argv:
+        sys.stdout.write(profile.collapsed())
+    else:
+        print(profile.to_json(indent=2))
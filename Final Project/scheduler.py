@@ -0,0 +1,113 @@
+'''
+This file interleaves many gradings on one thread, a slice of steps at a time.
+Each job is a paused Turing Machine. The scheduler runs the jobs round robin for slice_steps steps
+each, so a long route can't hold up the short ones behind it, and finishes a job when its machine
+stops, its own step budget runs out, or it is cancelled. A job between slices can also be suspended
+into a few bytes (see Turing.__getstate__) and resumed later, in this or another process.
+'''
+
+from collections import deque
+import pickle
+
+import language
+from lexer import RouteError, lexer_for
+
+
+class Job(object):
+    def __init__(self, route, max_steps=language.MAX_STEPS, machine=language.machine):
+        self.route = route
+        self.max_steps = max_steps
+        self.steps = 0
+        self.result = None ## ("Accept", grade) or ("Reject", reason) once done, same as language.grade
+        self.turing = None
+        try:
+            tape = lexer_for(machine).tape(route)
+            self.turing = language.Turing(tape, "[]", machine.initial_state, machine.final_states, machine.transition_function, machine)
+        except RouteError as error:
+            self.result = ("Reject", str(error))
+
+    def done(self):
+        return self.result != None
+
+    def run(self, k):
+        '''Runs the job for up to k more steps. Returns True once it is done.'''
+        turing = self.turing
+        self.steps += turing.run(min(k, self.max_steps - self.steps))
+        if turing.final():
+            self.result = ("Accept", turing.tape[turing.head_position - 1])
+        elif turing.halted() or self.steps >= self.max_steps:
+            self.result = ("Reject", turing.reject_reason())
+        return self.done()
+
+    def cancel(self):
+        if not self.done():
+            self.result = ("Reject", "cancelled after %d steps" % self.steps)
+
+
+class Scheduler(object):
+    def __init__(self, slice_steps=4096, machine=language.machine):
+        if slice_steps < 1:
+            raise ValueError("slice_steps must be at least 1, got %r" % slice_steps)
+        self.slice_steps = slice_steps
+        self.machine = machine
+        self.queue = deque() ## Jobs still running, the next one to get a slice first
+        self.finished = deque() ## Jobs done but not yet handed out by run
+
+    def submit(self, route, max_steps=language.MAX_STEPS):
+        '''Queues a route for grading with its own step budget. Returns its Job.'''
+        return self.add(Job(route, max_steps, self.machine))
+
+    def add(self, job):
+        if job.done():
+            self.finished.append(job)
+        else:
+            self.queue.append(job)
+        return job
+
+    def cancel(self, job):
+        '''Stops a job. It comes out of run like any other, rejected as cancelled.'''
+        if job in self.queue:
+            self.queue.remove(job)
+            job.cancel()
+            self.finished.append(job)
+
+    def suspend(self, job):
+        '''Takes a running job off the queue and returns it pickled.'''
+        self.queue.remove(job)
+        return pickle.dumps(job, pickle.HIGHEST_PROTOCOL)
+
+    def resume(self, data):
+        '''Queues a job pickled by suspend. Returns the Job.'''
+        return self.add(pickle.loads(data))
+
+    def tick(self):
+        '''Gives the next job one slice. Returns it if that finished it, otherwise None.'''
+        if not self.queue:
+            return None
+        job = self.queue.popleft()
+        if job.run(self.slice_steps):
+            return job
+        self.queue.append(job)
+        return None
+
+    def run(self):
+        '''Runs every queued job, yielding each one as it finishes. Jobs can be submitted, cancelled or
+        suspended between yields.'''
+        while self.queue or self.finished:
+            while self.finished:
+                yield self.finished.popleft()
+            job = self.tick()
+            if job != None:
+                yield job
+
+    def __len__(self):
+        return len(self.queue) + len(self.finished)
+
+
+def grade_interleaved(routes, slice_steps=4096, max_steps=language.MAX_STEPS):
+    '''Grades routes interleaved on one scheduler. Returns the results in the order of the routes.'''
+    scheduler = Scheduler(slice_steps)
+    jobs = [scheduler.submit(route, max_steps) for route in routes]
+    for _ in scheduler.run():
+        pass
+    return [job.result for job in jobs]
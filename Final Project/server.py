@@ -0,0 +1,274 @@
+'''
+This file serves grading over TCP with asyncio, one JSON object per line each way.
+A request is {"id": ..., "route": "B_Crimp_Dyno_Jug", "max_steps": 100000} (id and max_steps optional)
+and its response {"id": ..., "verdict": "Accept", "grade": "V2"} or {"id": ..., "verdict": "Reject",
+"reason": "..."}, the same verdicts as accept. {"op": "stats"} answers with the server metrics.
+Responses on a connection come back as they finish, not in request order, so requests carry an id.
+Gradings run on a pool of worker processes. Requests wait in a bounded queue; once it is full the
+server stops reading from the connections that are sending, so clients are slowed down by TCP itself
+instead of the queue growing without bound. Requests for a route (and budget) already queued or
+being graded share that one computation. The step budget of a request is capped at the server's and
+must be positive. A line longer than LINE_LIMIT gets an error and ends its connection.
+    python server.py serve [--host 127.0.0.1] [--port 8765] [--workers N] [--queue 1024] [--max-steps N]
+    python server.py load [--port 8765] [--connections 8] [--requests 2000] [--repeat 0.5]
+The load generator starts a server of its own in this process if no --port is given.
+'''
+
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import random
+import time
+
+import formula
+import language
+
+
+LINE_LIMIT = 1 << 24 ## Longest request line, a 10,000-token route is about 80 KB
+
+
+def _grade(route, max_steps): ## Runs in a worker process
+    return language.grade(route, max_steps)
+
+
+def percentiles(samples, points=(50, 90, 99, 99.9)):
+    '''Nearest-rank percentiles of samples, as {"p50": ..., ...}.'''
+    ordered = sorted(samples)
+    result = {}
+    for point in points:
+        name = "p%g" % point
+        if ordered:
+            result[name] = ordered[min(len(ordered) - 1, int(len(ordered) * point / 100.0))]
+        else:
+            result[name] = None
+    return result
+
+
+class Server(object):
+    def __init__(self, workers=None, queue_size=1024, max_steps=language.MAX_STEPS, executor=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_steps = max_steps
+        self.executor = executor ## Made when the server starts if not given
+        self.queue = None ## Pending (key, future), made on the server's event loop
+        self.inflight = {} ## (route, budget) -> future of its result, queued or being graded
+        self.latencies = deque(maxlen=100000) ## Seconds from request to response, most recent first out
+        self.max_depth = 0
+        self.requests = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.tasks = []
+        self.connections = set() ## Handlers of the open connections
+        self.server = None
+
+    async def start(self, host="127.0.0.1", port=0):
+        '''Starts listening. Returns the port, useful with port=0.'''
+        if self.executor == None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        ## Start the workers now: forked later, they would inherit the open connections and keep them from closing
+        await asyncio.get_event_loop().run_in_executor(self.executor, _grade, "", 0)
+        self.queue = asyncio.Queue(self.queue_size)
+        dispatchers = self.workers or os.cpu_count() or 1
+        self.tasks = [asyncio.ensure_future(self._dispatch()) for _ in range(dispatchers)]
+        self.server = await asyncio.start_server(self._serve, host, port, limit=LINE_LIMIT)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        '''Stops listening, lets the open connections finish, then shuts the pool down.'''
+        self.server.close()
+        if self.connections:
+            await asyncio.wait(self.connections)
+        await self.server.wait_closed()
+        for task in self.tasks:
+            task.cancel()
+        self.executor.shutdown()
+
+    async def _dispatch(self): ## Hands queued gradings to the pool, one at a time per worker
+        loop = asyncio.get_event_loop()
+        while True:
+            key, future = await self.queue.get()
+            try:
+                future.set_result(await loop.run_in_executor(self.executor, _grade, *key))
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                del self.inflight[key]
+
+    async def submit(self, route, max_steps=None):
+        '''Queues a route for grading, waiting while the queue is full. Returns the future of its result,
+        shared with any identical request still queued or being graded.'''
+        if not isinstance(route, str):
+            raise TypeError("route must be a string")
+        budget = self.max_steps if max_steps == None else min(int(max_steps), self.max_steps)
+        if budget < 1:
+            raise ValueError("max_steps must be positive")
+        key = (route, budget)
+        if key in self.inflight:
+            self.coalesced += 1
+            return self.inflight[key]
+        future = asyncio.get_event_loop().create_future()
+        self.inflight[key] = future
+        await self.queue.put((key, future))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return future
+
+    async def grade(self, route, max_steps=None):
+        '''Grades a route through the queue and pool. Returns ("Accept", grade) or ("Reject", reason).'''
+        return await asyncio.shield(await self.submit(route, max_steps))
+
+    def stats(self):
+        return {"requests": self.requests, "coalesced": self.coalesced, "errors": self.errors,
+                "queue_depth": self.queue.qsize(), "max_queue_depth": self.max_depth,
+                "queue_size": self.queue_size, "inflight": len(self.inflight),
+                "latency": percentiles(self.latencies)}
+
+    async def _answer(self, request, future, writer, start):
+        response = {"id": request.get("id")}
+        try:
+            verdict, detail = await asyncio.shield(future)
+            response["verdict"] = verdict
+            response["grade" if verdict == "Accept" else "reason"] = detail
+        except Exception as error:
+            self.errors += 1
+            response["error"] = "%s: %s" % (type(error).__name__, error)
+        self.latencies.append(time.perf_counter() - start)
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+
+    async def _serve(self, reader, writer):
+        self.connections.add(asyncio.current_task())
+        pending = set()
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError: ## Longer than LINE_LIMIT, the rest of the stream can't be split into requests
+                    self.errors += 1
+                    writer.write((json.dumps({"id": None, "error": "bad request: line too long"}) + "\n").encode("utf-8"))
+                    break
+                if not line:
+                    break
+                start = time.perf_counter()
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request must be a JSON object")
+                except ValueError as error:
+                    self.errors += 1
+                    writer.write((json.dumps({"id": None, "error": "bad request: %s" % error}) + "\n").encode("utf-8"))
+                    continue
+                if request.get("op") == "stats":
+                    writer.write((json.dumps(dict(self.stats(), id=request.get("id"))) + "\n").encode("utf-8"))
+                    continue
+                self.requests += 1
+                try:
+                    future = await self.submit(request.get("route"), request.get("max_steps")) ## Stops reading while the queue is full
+                except (TypeError, ValueError) as error:
+                    self.errors += 1
+                    writer.write((json.dumps({"id": request.get("id"), "error": "bad request: %s" % error}) + "\n").encode("utf-8"))
+                    continue
+                task = asyncio.ensure_future(self._answer(request, future, writer, start))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                await writer.drain()
+            if pending:
+                await asyncio.wait(pending)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            self.connections.discard(asyncio.current_task())
+
+
+async def load(host, port, connections=8, requests=2000, repeat=0.5, max_tokens=40, seed=0):
+    '''Load generator: sends requests random routes over connections connections, with a share of
+    repeat of them reusing an earlier route. Returns the client-side metrics and the server's stats.'''
+    rng = random.Random(seed)
+    routes = []
+    for _ in range(requests):
+        if routes and rng.random() < repeat:
+            routes.append(rng.choice(routes))
+        else:
+            routes.append(formula.random_route(rng, max_tokens))
+    latencies = []
+    verdicts = {"Accept": 0, "Reject": 0, "error": 0}
+
+    async def client(share):
+        reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        sent = {}
+        for index in share:
+            sent[index] = time.perf_counter()
+            writer.write((json.dumps({"id": index, "route": routes[index]}) + "\n").encode("utf-8"))
+        await writer.drain()
+        for _ in share:
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - sent[response["id"]])
+            verdicts[response.get("verdict", "error")] += 1
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(range(number, requests, connections)) for number in range(connections)])
+    elapsed = time.perf_counter() - start
+    return {"requests": requests, "seconds": elapsed, "throughput": requests / elapsed, "verdicts": verdicts,
+            "latency": percentiles(latencies), "server": await stats(host, port)}
+
+
+async def stats(host, port):
+    '''Metrics of a running server.'''
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "stats"}\n')
+    response = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return response
+
+
+async def _load_main(args):
+    server = None
+    port = args.port
+    if port == None:
+        server = Server(args.workers, args.queue, args.max_steps)
+        port = await server.start(args.host, 0)
+    try:
+        report = await load(args.host, port, args.connections, args.requests, args.repeat, args.max_tokens, args.seed)
+    finally:
+        if server != None:
+            await server.stop()
+    print(json.dumps(report, indent=2))
+
+
+async def _serve_main(args):
+    server = Server(args.workers, args.queue, args.max_steps)
+    port = await server.start(args.host, args.port)
+    print("grading on %s:%d" % (args.host, port))
+    await server.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grading server and its load generator.")
+    parser.add_argument("command", choices=("serve", "load"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--workers", type=int, help="worker processes, all cores by default")
+    parser.add_argument("--queue", type=int, default=1024, help="gradings that may wait for a worker")
+    parser.add_argument("--max-steps", type=int, default=language.MAX_STEPS, help="largest step budget of a request")
+    parser.add_argument("--connections", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--repeat", type=float, default=0.5, help="share of requests repeating an earlier route")
+    parser.add_argument("--max-tokens", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if args.command == "serve":
+        if args.port == None:
+            args.port = 8765
+        asyncio.run(_serve_main(args))
+    else:
+        asyncio.run(_load_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+'''
+This file grades a stream of routes from the command line, one route per line or one JSON object
+per line ({"route": ..., "id": ...}), from files or stdin.
+Routes are read lazily and graded in chunks on a pool of worker processes while the next lines are
+parsed and earlier results written out, with at most window chunks in flight, so memory stays flat
+however long the input is. Each result is written as soon as it is known, in input order by default
+or as they complete with --unordered, as tab-separated line, verdict, grade or reason, and steps,
+or as JSON lines with --output jsonl.
+    python stream.py [FILE ...] [--jsonl] [--output tsv|jsonl] [--workers N] [--window 64]
+                     [--chunksize 64] [--unordered] [--max-steps N]
+'''
+
+import argparse
+from collections import deque
+import json
+import multiprocessing
+import queue
+import sys
+import time
+
+import language
+from scheduler import Job
+
+
+_max_steps = language.MAX_STEPS ## Step budget of this worker process
+
+
+def _start_worker(max_steps):
+    global _max_steps
+    _max_steps = max_steps
+
+
+def _grade_chunk(chunk):
+    '''Grades a chunk of (line, id, route, error) records. Returns (line, id, result, steps) for each.'''
+    graded = []
+    for line, ident, route, error in chunk:
+        if error != None:
+            graded.append((line, ident, ("Error", error), 0))
+            continue
+        job = Job(route, _max_steps)
+        if not job.done():
+            job.run(_max_steps)
+        graded.append((line, ident, job.result, job.steps))
+    return graded
+
+
+def parse(lines, jsonl=False):
+    '''Yields a (line number, id, route, error) record per non-blank input line.'''
+    for number, text in enumerate(lines, 1):
+        text = text.rstrip("\r\n")
+        if not text.strip():
+            continue
+        if not jsonl:
+            yield number, None, text, None
+            continue
+        try:
+            record = json.loads(text)
+            if not isinstance(record, dict) or not isinstance(record.get("route"), str):
+                raise ValueError("expected an object with a route string")
+            yield number, record.get("id"), record["route"], None
+        except ValueError as error:
+            yield number, None, None, "bad line: %s" % error
+
+
+def _chunks(records, size):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def grade_stream(lines, jsonl=False, workers=None, window=64, chunksize=64, ordered=True, max_steps=language.MAX_STEPS):
+    '''Grades the routes of lines as a stream. Yields a list of (line number, id, result, steps) per chunk,
+    where result is what language.grade returns, or ("Error", message) for a line that couldn't be read.
+    At most window chunks are graded or waiting at a time. workers=0 grades in this process.'''
+    chunks = _chunks(parse(lines, jsonl), chunksize)
+    if workers == 0:
+        _start_worker(max_steps)
+        for chunk in chunks:
+            yield _grade_chunk(chunk)
+        return
+    with multiprocessing.Pool(workers, _start_worker, (max_steps,)) as pool:
+        if ordered:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_grade_chunk, (chunk,)))
+                while pending and (len(pending) >= window or pending[0].ready()):
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        else:
+            done = queue.Queue()
+            inflight = 0
+            for chunk in chunks:
+                pool.apply_async(_grade_chunk, (chunk,), callback=done.put, error_callback=done.put)
+                inflight += 1
+                while inflight and (inflight >= window or not done.empty()):
+                    graded = done.get()
+                    inflight -= 1
+                    if isinstance(graded, BaseException):
+                        raise graded
+                    yield graded
+            while inflight:
+                graded = done.get()
+                inflight -= 1
+                if isinstance(graded, BaseException):
+                    raise graded
+                yield graded
+
+
+def format_result(line, ident, result, steps, output="tsv"):
+    verdict, detail = result
+    if output == "jsonl":
+        record = {"line": line}
+        if ident != None:
+            record["id"] = ident
+        record["verdict"] = verdict
+        record["grade" if verdict == "Accept" else "reason" if verdict == "Reject" else "error"] = detail
+        record["steps"] = steps
+        return json.dumps(record)
+    return "%d\t%s\t%s\t%d" % (line, verdict, detail if isinstance(detail, str) else "", steps)
+
+
+def _inputs(paths):
+    '''Lines of every file in paths in turn ("-" or no paths at all is stdin), read lazily.'''
+    for path in paths or ["-"]:
+        if path == "-":
+            for line in sys.stdin:
+                yield line
+        else:
+            with open(path, encoding="utf-8") as lines:
+                for line in lines:
+                    yield line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Grade a stream of routes.")
+    parser.add_argument("files", nargs="*", help="route files, stdin if none or -")
+    parser.add_argument("--jsonl", action="store_true", help="input lines are JSON objects with a route (default for .jsonl files)")
+    parser.add_argument("--output", choices=("tsv", "jsonl"), default="tsv")
+    parser.add_argument("--workers", type=int, help="worker processes, all cores by default, 0 for none")
+    parser.add_argument("--window", type=int, default=64, help="chunks in flight at most")
+    parser.add_argument("--chunksize", type=int, default=64, help="routes per chunk")
+    parser.add_argument("--unordered", action="store_true", help="write results as they complete")
+    parser.add_argument("--max-steps", type=int, default=language.MAX_STEPS)
+    args = parser.parse_args(argv)
+
+    jsonl = args.jsonl or (args.files != [] and all(path.endswith(".jsonl") for path in args.files))
+    counts = {"Accept": 0, "Reject": 0, "Error": 0}
+    start = time.perf_counter()
+    for graded in grade_stream(_inputs(args.files), jsonl, args.workers, args.window, args.chunksize,
+                               not args.unordered, args.max_steps):
+        for line, ident, result, steps in graded:
+            counts[result[0]] += 1
+            sys.stdout.write(format_result(line, ident, result, steps, args.output) + "\n")
+        sys.stdout.flush()
+    elapsed = time.perf_counter() - start
+    total = sum(counts.values())
+    sys.stderr.write("%d routes in %.2fs (%.0f/s): %d accepted, %d rejected, %d unreadable\n"
+                     % (total, elapsed, total / elapsed if elapsed else 0.0, counts["Accept"], counts["Reject"], counts["Error"]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
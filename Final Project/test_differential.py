@@ -0,0 +1,36 @@
+'''
+This file runs the differential checks of formula.py, codegen.py and incremental.py with fixed seeds,
+so a mismatch between the machine, the generated code and the fold fails the test run.
+    python -m pytest -q
+'''
+
+import random
+
+import codegen
+import formula
+import incremental
+
+
+def _routes(count, seed, max_tokens=16):
+    rng = random.Random(seed)
+    return [formula.random_route(rng, max_tokens) for _ in range(count)]
+
+
+def test_formula_matches_machine():
+    assert formula.differential(1000, seed=510) == []
+
+
+def test_formula_matches_machine_on_small_budgets():
+    assert formula.differential(300, seed=511, max_steps=500) == []
+
+
+def test_codegen_matches_interpreter():
+    assert codegen.differential(_routes(200, 512)) == []
+
+
+def test_incremental_matches_machine():
+    assert incremental.differential(60, seed=513) == []
+
+
+def test_incremental_matches_machine_on_small_budgets():
+    assert incremental.differential(30, seed=514, max_steps=2000) == []
@@ -0,0 +1,155 @@
+'''
+This file defines a compact execution trace for the Turing Machine.
+Instead of a full copy of the tape for every step, each step only records the state, the head position,
+and the old and new symbol of the cell that was written. A sweep (a run of steps that rewrite the same symbol
+and keep moving the same way) is a single record holding its signed length, since it changes no cells.
+A full configuration is rebuilt on demand by replaying those deltas from the nearest checkpoint
+(a copy of the tape taken every checkpoint_every records).
+The records can be kept in memory or streamed to a file in fixed-size chunks, in which case only the
+checkpoints and the chunk currently being filled stay in RAM. The file belongs to the trace: close it
+(or use the trace in a with block) once you are done reading.
+Iterating over a Trace gives the same (state, tape, head) tuples accept used to put in its path list,
+and indexing or slicing it gives them like that list did.
+'''
+
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from engine import Tape
+
+
+CHUNK = 4096 ## Records per chunk when streaming to a file
+COLUMNS = (('H', 2), ('i', 4), ('H', 2), ('H', 2), ('i', 4)) ## state, head, old symbol, new symbol, sweep length
+
+
+def _columns():
+    return [array(typecode) for typecode, _ in COLUMNS]
+
+
+class Trace(object):
+    def __init__(self, machine, tape, state, head, checkpoint_every=1024, path=None):
+        '''Starts a trace at the current configuration of a live tape. The tape is snapshotted every
+        checkpoint_every records while recording. If path is given, records are streamed to that file.'''
+        self.machine = machine
+        self.tape = tape
+        self.foreign = dict(tape.foreign)
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_steps = [0] ## Step each checkpoint was taken before, for bisecting
+        self.checkpoints = [(0, tape.snapshot())] ## (record index, tape) before that step
+        self.length = 0 ## Steps, sweeps count as many steps
+        self.count = 0 ## Records
+        self.columns = _columns()
+        self.file = None
+        self.chunks = 0 ## Full chunks written to the file
+        if path != None:
+            self.file = open(path, "w+b")
+        self._chunk_cache = (None, None)
+
+    def record(self, state, head, old, new, sweep=0):
+        '''Records one step, taken from (state, head), that replaced old with new under the head.
+        Must be called before the write so checkpoints see the tape as it was before the step.
+        A non-zero sweep records abs(sweep) steps in state that only move the head by sign(sweep) each.'''
+        if self.count % self.checkpoint_every == 0 and self.count:
+            self.checkpoint_steps.append(self.length)
+            self.checkpoints.append((self.count, self.tape.snapshot()))
+        columns = self.columns
+        columns[0].append(state)
+        columns[1].append(head)
+        columns[2].append(old)
+        columns[3].append(new)
+        columns[4].append(sweep)
+        self.length += abs(sweep) or 1
+        self.count += 1
+        if self.file != None and len(columns[0]) == CHUNK:
+            for column in columns:
+                column.tofile(self.file)
+            self.columns = _columns()
+            self.chunks += 1
+
+    def __getstate__(self): ## Finished in-memory traces pickle without the live tape
+        if self.file != None:
+            raise TypeError("a trace streamed to a file can't be pickled")
+        state = dict(self.__dict__)
+        state["tape"] = None
+        return state
+
+    def close(self): ## Close the backing file, the trace can't be read after this
+        if self.file != None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.length
+
+    def size(self): ## Bytes held in memory by the records and checkpoints
+        records = sum(len(column) * column.itemsize for column in self.columns)
+        return records + sum(len(snapshot[1]) for _, snapshot in self.checkpoints)
+
+    def _chunk(self, index): ## Columns of one full chunk read back from the file
+        if self._chunk_cache[0] != index:
+            columns = _columns()
+            self.file.seek(index * CHUNK * sum(size for _, size in COLUMNS))
+            for column in columns:
+                column.fromfile(self.file, CHUNK)
+            self.file.seek(0, 2)
+            self._chunk_cache = (index, columns)
+        return self._chunk_cache[1]
+
+    def records(self, start=0):
+        '''Yields (state, head, old, new, sweep) codes for every record from record index start on.'''
+        chunk_start = 0
+        if self.file != None:
+            chunk_start = self.chunks * CHUNK
+            for index in range(start // CHUNK, self.chunks):
+                states, heads, olds, news, sweeps = self._chunk(index)
+                for k in range(max(start - index * CHUNK, 0), CHUNK):
+                    yield states[k], heads[k], olds[k], news[k], sweeps[k]
+            start = max(start, chunk_start)
+        states, heads, olds, news, sweeps = self.columns
+        for k in range(start - chunk_start, self.count - chunk_start):
+            yield states[k], heads[k], olds[k], news[k], sweeps[k]
+
+    def configurations(self, start=0):
+        '''Lazily yields (state, tape, head) for every step from start on, seeking to start through the
+        nearest checkpoint before it. The tape string is the same one Turing.get_tape gives.'''
+        if start >= self.length:
+            return
+        checkpoint = bisect_right(self.checkpoint_steps, start) - 1
+        step = self.checkpoint_steps[checkpoint]
+        record, snapshot = self.checkpoints[checkpoint]
+        tape = Tape.restore(self.machine.alphabet, snapshot, self.foreign)
+        states = self.machine.states
+        for state, head, old, new, sweep in self.records(record):
+            if sweep:
+                move = 1 if sweep > 0 else -1
+                text = str(tape)
+                for k in range(max(start - step, 0), abs(sweep)):
+                    yield states[state], text, head + k * move
+                step += abs(sweep)
+                continue
+            if step >= start:
+                yield states[state], str(tape), head
+            tape.write_code(head, new)
+            step += 1
+
+    def __iter__(self):
+        return self.configurations()
+
+    def __getitem__(self, n): ## Configuration before step n, or a list of them for a slice
+        if isinstance(n, slice):
+            steps = range(*n.indices(self.length))
+            if not steps:
+                return []
+            first = min(steps)
+            window = list(islice(self.configurations(first), max(steps) - first + 1))
+            return [window[step - first] for step in steps]
+        if n < 0:
+            n += self.length
+        if not 0 <= n < self.length:
+            raise IndexError("trace index out of range")
+        return next(self.configurations(n))